@@ -0,0 +1,153 @@
+import threading
+from collections import deque
+
+from Vitals import OBSERVATION_TYPES_BY_CODE, first_coding, utc_seconds
+
+## Streaming anomaly detection for device observations.
+## Each (patient, device, LOINC code) series keeps a fixed-size rolling state, so every reading is O(1):
+##   - threshold window: the OBSERVATION_TYPES range must be breached for BREACH_WINDOW consecutive readings
+##   - EWMA mean/variance: readings more than ZSCORE_LIMIT deviations from the series' own baseline
+##   - rate of change: per-hour change larger than RATE_LIMITS allows
+## Flags are kept per patient in a bounded deque so the Dashboard and Chat read them without scanning history.
+## forget() drops a patient's series and flags; Utils calls it when the ObservationStore evicts the patient,
+## so this state is bounded by the store and is rebuilt when the patient is loaded again.
+
+ALPHA = 0.2 # EWMA smoothing factor
+ZSCORE_LIMIT = 3.0
+WARMUP_READINGS = 5 # readings before the EWMA baseline is trusted
+BREACH_WINDOW = 1 # consecutive out-of-range readings before a threshold flag
+MAX_FLAGS_PER_PATIENT = 200
+
+# Largest plausible change per hour. Defaults to the width of the normal range when not listed.
+RATE_LIMITS = {
+    "8867-4": 40, # Heart rate, bpm/h
+    "59408-5": 5, # SpO2, %/h
+    "15074-8": 4, # Glucose, mmol/L/h
+    "8310-5": 1.5, # Body temperature, Cel/h
+}
+
+class SeriesState:
+    __slots__ = ("count", "mean", "var", "last_value", "last_time", "breaches")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.last_value = None
+        self.last_time = None
+        self.breaches = 0
+
+def parse_time(value):
+    # Any FHIR dateTime precision ("2025-01" included); naive values are read as UTC, not host-local time
+    return utc_seconds(value)
+
+class AnomalyDetector:
+    def __init__(self):
+        self.series = {} # patient -> {(device, code): SeriesState}
+        self.flags = {}
+        self._lock = threading.Lock()
+        self._limits = {
+            code: (t["range"][0], t["range"][1], RATE_LIMITS.get(code, t["range"][1] - t["range"][0]), t["label"])
+            for code, t in OBSERVATION_TYPES_BY_CODE.items()
+        }
+
+    def _flag(self, patient, flag):
+        flags = self.flags.get(patient)
+        if flags is None:
+            flags = self.flags[patient] = deque(maxlen=MAX_FLAGS_PER_PATIENT)
+        flags.append(flag)
+
+    def observe(self, patient, device, code, value, timestamp, effective=""):
+        """Feed one reading (timestamp in epoch seconds). Returns the flags raised by it."""
+        limits = self._limits.get(code)
+        key = (device, code)
+        patient_series = self.series.get(patient)
+        if patient_series is None:
+            patient_series = self.series[patient] = {}
+        state = patient_series.get(key)
+        if state is None:
+            state = patient_series[key] = SeriesState()
+        elif state.last_time is not None and timestamp <= state.last_time:
+            return [] # already seen, or out of order: the rolling state only moves forward
+
+        raised = []
+        label = limits[3] if limits else code
+        if limits:
+            low, high, rate_limit, _ = limits
+            if value < low or value > high:
+                state.breaches += 1
+                if state.breaches == BREACH_WINDOW:
+                    raised.append(("out_of_range", f"{label} {value} outside {low}-{high}"))
+            else:
+                state.breaches = 0
+            if state.last_value is not None:
+                hours = max((timestamp - state.last_time) / 3600.0, 1 / 60.0) # clamp to one minute
+                rate = abs(value - state.last_value) / hours
+                if rate > rate_limit:
+                    raised.append(("rate_of_change", f"{label} changed {state.last_value} -> {value} ({rate:.1f}/h)"))
+
+        if state.count >= WARMUP_READINGS and state.var > 0:
+            z = (value - state.mean) / state.var ** 0.5
+            if abs(z) > ZSCORE_LIMIT:
+                raised.append(("deviation", f"{label} {value} is {z:+.1f} SD from recent mean {state.mean:.1f}"))
+
+        # Exponentially weighted mean/variance update
+        if state.count == 0:
+            state.mean = value
+        else:
+            diff = value - state.mean
+            increment = ALPHA * diff
+            state.mean += increment
+            state.var = (1 - ALPHA) * (state.var + diff * increment)
+        state.count += 1
+        state.last_value = value
+        state.last_time = timestamp
+
+        flags = [
+            {"patient": patient, "device": device, "code": code, "kind": kind, "message": message,
+             "value": value, "effectiveDateTime": effective}
+            for kind, message in raised
+        ]
+        for flag in flags:
+            self._flag(patient, flag)
+        return flags
+
+    def ingest(self, observations):
+        """Feed a batch of Observation resources, oldest first. Returns the new flags."""
+        readings = []
+        for obs in observations:
+            value = obs.get("valueQuantity", {}).get("value")
+            effective = obs.get("effectiveDateTime")
+            if value is None or not effective:
+                continue
+            try:
+                timestamp = parse_time(effective)
+            except ValueError:
+                continue
+            readings.append((
+                timestamp,
+                obs.get("subject", {}).get("reference", "").split("/")[-1],
+                obs.get("device", {}).get("reference", "").split("/")[-1],
+                first_coding(obs.get("code")).get("code"),
+                value,
+                effective,
+            ))
+        readings.sort(key=lambda r: r[0])
+        return self.ingest_readings(readings)
+
+    def ingest_readings(self, readings):
+        """Feed (timestamp, patient, device, code, value, effective) tuples, oldest first."""
+        new_flags = []
+        with self._lock:
+            for timestamp, patient, device, code, value, effective in readings:
+                new_flags += self.observe(patient, device, code, value, timestamp, effective)
+        return new_flags
+
+    def get_flags(self, patient):
+        with self._lock:
+            return list(self.flags.get(patient, ()))
+
+    def forget(self, patient):
+        with self._lock:
+            self.series.pop(patient, None)
+            self.flags.pop(patient, None)
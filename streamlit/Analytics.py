@@ -0,0 +1,196 @@
+import argparse
+import glob
+import json
+import math
+import os
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from Vitals import OBSERVATION_TYPES_BY_CODE, first_coding
+
+## Cohort-wide vital-sign aggregates over Observation/Device NDJSON from $export (or the JSON arrays
+## written by fakerDevices). Observations are streamed and reduced chunk by chunk, so they cost memory
+## only per chunk and per distinct code. The exact patient count and per-device-type totals keep one
+## small entry per patient id and per device id, so memory still grows linearly with the number of
+## patients and devices (tens of bytes each), but not with the number of observations.
+## Usage: python Analytics.py <export dir or files...> --out cohort_aggregates.json
+## Home.py reads the resulting JSON file; nothing here touches the FHIR server.
+
+CHUNK_SIZE = 50000
+AGGREGATES_PATH = "cohort_aggregates.json"
+QUANTILES = (0.05, 0.5, 0.95, 0.99)
+
+class QuantileSketch:
+    """Log-bucketed quantile sketch (DDSketch style) with ~1% relative error and mergeable counts."""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.non_positive = 0
+        self.count = 0
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        positive = values[values > 0]
+        self.non_positive += len(values) - len(positive)
+        self.count += len(values)
+        if len(positive):
+            keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+            self.buckets.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.non_positive
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+def iter_resources(paths):
+    for path in paths:
+        with open(path) as f:
+            if path.endswith(".ndjson"):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield from json.load(f)
+
+def expand_paths(paths):
+    # A directory is treated as a $export download: every .ndjson file in it
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            expanded += sorted(glob.glob(os.path.join(path, "*.ndjson")))
+        else:
+            expanded.append(path)
+    return expanded
+
+def reference_id(reference):
+    return (reference or {}).get("reference", "").split("/")[-1]
+
+class CohortAggregator:
+    def __init__(self):
+        self.stats = {}  # code -> running totals
+        self.sketches = {}
+        # One entry per device / patient id: these grow with the cohort, not with the observations
+        self.device_types = {}  # device id -> device type display
+        self.readings_per_device = Counter()
+        self.patients = set()
+
+    def add_observations(self, rows):
+        df = pd.DataFrame(rows, columns=["code", "display", "unit", "value", "device", "patient"])
+        self.patients.update(df["patient"].unique().tolist())
+        self.readings_per_device.update(df["device"].value_counts().to_dict())
+        df = df.dropna(subset=["value"])
+        for code, group in df.groupby("code"):
+            values = group["value"].to_numpy(dtype=float)
+            low, high = OBSERVATION_TYPES_BY_CODE.get(code, {}).get("range", (None, None))
+            totals = self.stats.setdefault(code, {
+                "display": group["display"].iloc[0], "unit": group["unit"].iloc[0],
+                "count": 0, "sum": 0.0, "sumsq": 0.0, "min": math.inf, "max": -math.inf,
+                "below_range": 0, "above_range": 0, "range": [low, high]
+            })
+            totals["count"] += len(values)
+            totals["sum"] += float(values.sum())
+            totals["sumsq"] += float(np.square(values).sum())
+            totals["min"] = min(totals["min"], float(values.min()))
+            totals["max"] = max(totals["max"], float(values.max()))
+            if low is not None:
+                totals["below_range"] += int((values < low).sum())
+                totals["above_range"] += int((values > high).sum())
+            self.sketches.setdefault(code, QuantileSketch()).add_many(values)
+
+    def consume(self, resources, chunk_size=CHUNK_SIZE):
+        rows = []
+        for resource in resources:
+            resource_type = resource.get("resourceType")
+            if resource_type == "Device":
+                self.device_types[resource.get("id")] = (
+                    first_coding(resource.get("type")).get("display") or resource.get("type", {}).get("text", "Unknown")
+                )
+            elif resource_type == "Observation":
+                coding = first_coding(resource.get("code"))
+                quantity = resource.get("valueQuantity", {})
+                rows.append((
+                    coding.get("code"), coding.get("display"), quantity.get("unit"), quantity.get("value"),
+                    reference_id(resource.get("device")), reference_id(resource.get("subject"))
+                ))
+                if len(rows) == chunk_size:
+                    self.add_observations(rows)
+                    rows = []
+        if rows:
+            self.add_observations(rows)
+
+    def results(self):
+        vitals = {}
+        for code, totals in self.stats.items():
+            count = totals["count"]
+            mean = totals["sum"] / count
+            variance = max(totals["sumsq"] / count - mean * mean, 0.0)
+            sketch = self.sketches[code]
+            vitals[code] = {
+                "display": totals["display"],
+                "unit": totals["unit"],
+                "count": count,
+                "mean": mean,
+                "std": math.sqrt(variance),
+                "min": totals["min"],
+                "max": totals["max"],
+                "quantiles": {str(q): sketch.quantile(q) for q in QUANTILES},
+                "range": totals["range"],
+                "below_range": totals["below_range"],
+                "above_range": totals["above_range"],
+                "out_of_range_rate": (totals["below_range"] + totals["above_range"]) / count,
+            }
+        # Resolved at the end, since Device and Observation files can arrive in any order
+        device_types = {}
+        for device_id, device_type in self.device_types.items():
+            entry = device_types.setdefault(device_type, {"devices": 0, "readings": 0})
+            entry["devices"] += 1
+            entry["readings"] += self.readings_per_device.get(device_id, 0)
+        return {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "patients": len(self.patients),
+            "vitals": vitals,
+            "device_types": device_types,
+        }
+
+def compute_aggregates(paths, chunk_size=CHUNK_SIZE):
+    aggregator = CohortAggregator()
+    aggregator.consume(iter_resources(expand_paths(paths)), chunk_size=chunk_size)
+    return aggregator.results()
+
+def save_aggregates(aggregates, path=AGGREGATES_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(aggregates, f, indent=2)
+    os.replace(tmp_path, path)
+
+def load_aggregates(path=AGGREGATES_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute cohort vital-sign aggregates from $export NDJSON.")
+    parser.add_argument("paths", nargs="+", help="$export directories, .ndjson files or fakerDevices JSON arrays")
+    parser.add_argument("--out", default=AGGREGATES_PATH)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    aggregates = compute_aggregates(args.paths, chunk_size=args.chunk_size)
+    save_aggregates(aggregates, args.out)
+    print(f"Aggregated {sum(v['count'] for v in aggregates['vitals'].values())} observations for "
+          f"{aggregates['patients']} patients in {time.perf_counter() - start:.1f}s -> {args.out}")
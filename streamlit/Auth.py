@@ -0,0 +1,81 @@
+import time
+import streamlit as st
+from urllib.parse import urlencode
+
+import demoSettings
+
+## OAuth helpers and login session state, shared by Home.py and Utils.py.
+## Importing this module has no side effects (unlike importing Home, which renders the page),
+## and Authlib is only loaded when a token is actually exchanged or refreshed.
+
+AUTH0_AUTHORIZE_URL = f"https://{demoSettings.domain}/authorize"
+AUTH0_TOKEN_URL = f"https://{demoSettings.domain}/oauth/token"
+AUTH0_CLIENT_ID = demoSettings.client_id
+AUTH0_CLIENT_SECRET = demoSettings.client_secret
+AUTH0_CALLBACK_URL = "http://localhost:8501/"
+AUTH0_AUDIENCE = demoSettings.audience if hasattr(demoSettings, "audience") else None
+
+def get_oauth_session():
+    from authlib.integrations.requests_client import OAuth2Session
+    return OAuth2Session(AUTH0_CLIENT_ID, AUTH0_CLIENT_SECRET, redirect_uri=AUTH0_CALLBACK_URL)
+
+def get_authorize_url():
+    params = {
+        "client_id": AUTH0_CLIENT_ID,
+        "response_type": "code",
+        "redirect_uri": AUTH0_CALLBACK_URL,
+        "scope": "openid profile email",
+        "prompt": "login"
+    }
+    if AUTH0_AUDIENCE:
+        params["audience"] = AUTH0_AUDIENCE
+    return f"{AUTH0_AUTHORIZE_URL}?{urlencode(params)}"
+
+def get_token(code):
+    print("Exchanging code:", code)
+    print("Redirect URI:", AUTH0_CALLBACK_URL)
+    session = get_oauth_session()
+    token = session.fetch_token(
+        AUTH0_TOKEN_URL,
+        code=code,
+        grant_type="authorization_code",
+        client_secret=AUTH0_CLIENT_SECRET,
+    )
+    return token
+
+def get_user_info(token):
+    import requests
+    headers = {"Authorization": f"Bearer {token['access_token']}"}
+    resp = requests.get(f"https://{demoSettings.domain}/userinfo", headers=headers)
+    return resp.json()
+
+def refresh_access_token():
+    refresh_token = st.session_state.get("refresh_token")
+    if not refresh_token:
+        st.error("No refresh token available. Please log in again.")
+        st.stop()
+    session = get_oauth_session()
+    token = session.refresh_token(
+        AUTH0_TOKEN_URL,
+        refresh_token=refresh_token,
+        client_id=AUTH0_CLIENT_ID,
+        client_secret=AUTH0_CLIENT_SECRET,
+    )
+    st.session_state["access_token"] = token["access_token"]
+    if "expires_in" in token:
+        st.session_state["token_expiry"] = time.time() + token["expires_in"]
+    return token["access_token"]
+
+def store_token(token, user_info):
+    st.session_state["user"] = user_info
+    st.session_state["access_token"] = token["access_token"]
+    if "refresh_token" in token:
+        st.session_state["refresh_token"] = token["refresh_token"]
+    if "expires_in" in token:
+        st.session_state["token_expiry"] = time.time() + token["expires_in"]
+
+def get_valid_access_token():
+    expiry = st.session_state.get("token_expiry")
+    if expiry and time.time() > expiry:
+        return refresh_access_token()
+    return st.session_state.get("access_token")
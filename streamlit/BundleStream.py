@@ -0,0 +1,144 @@
+import codecs
+import json
+import re
+
+## Incremental parser for FHIR Bundles read from a streamed HTTP response.
+## Only Bundle.entry is parsed: each entry is sliced out of the text as soon as its closing brace
+## arrives and decoded on its own, so peak memory is one entry plus one network chunk rather than
+## the whole Bundle (and its json() copy). Everything outside Bundle.entry is skipped.
+
+_TOKEN = re.compile(r'["{}\[\]]')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_WHITESPACE = re.compile(r'[\s,]*')
+_SCALAR = re.compile(r'[^,}\]\s]*')
+_RESOURCE_TYPE = re.compile(r'"resourceType"\s*:\s*"([A-Za-z]+)"')
+
+class _Scanner:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """Read the next chunk into the buffer. Returns False at end of stream."""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            self.buf += self.decoder.decode(b"", final=True)
+            return False
+        # Drop what's already been consumed so the buffer only holds the current entry
+        self.buf = self.buf[self.pos:] + (self.decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+        self.pos = 0
+        return True
+
+    def skip_separators(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.more():
+                return self.buf[self.pos:self.pos + 1]
+
+    def read_string(self):
+        """Consume the string starting at self.pos and return it decoded."""
+        while True:
+            match = _STRING.match(self.buf, self.pos)
+            if match:
+                self.pos = match.end()
+                return json.loads(match.group())
+            if not self.more():
+                raise ValueError("Unterminated string in Bundle")
+
+    def skip_scalar(self):
+        """Consume a number, true, false or null."""
+        while True:
+            end = _SCALAR.match(self.buf, self.pos).end()
+            if end < len(self.buf) or not self.more():
+                self.pos = _SCALAR.match(self.buf, self.pos).end()
+                return
+
+    def _more_keeping(self, resume):
+        # Read more while keeping the unfinished value at the front of the buffer;
+        # scanning then resumes at `resume` (relative to the value start)
+        self.pos = self.value_start
+        if not self.more():
+            raise ValueError("Truncated Bundle")
+        self.value_start, self.pos = 0, resume
+
+    def skip_value(self):
+        """Advance past one complete {...} or [...] value starting at self.pos.
+        Its text is then self.buf[self.value_start:self.pos]."""
+        depth = 0
+        self.value_start = self.pos
+        while True:
+            match = _TOKEN.search(self.buf, self.pos)
+            if not match:
+                self._more_keeping(len(self.buf) - self.value_start)
+                continue
+            char = match.group()
+            if char == '"':
+                string = _STRING.match(self.buf, match.start())
+                if not string:
+                    # Incomplete string: resume from its opening quote after more data
+                    self._more_keeping(match.start() - self.value_start)
+                    continue
+                self.pos = string.end()
+                continue
+            self.pos = match.end()
+            depth += 1 if char in "{[" else -1
+            if depth == 0:
+                return
+
+def iter_bundle_resources(chunks, resource_types=None, elements=None):
+    """Yield Bundle.entry[].resource from an iterable of bytes/str chunks.
+
+    `resource_types` limits which resources are decoded (others are skipped without parsing),
+    and `elements` projects each resource to those top-level elements plus resourceType and id.
+    """
+    scanner = _Scanner(chunks)
+    keep = set(elements) | {"resourceType", "id"} if elements else None
+    # Find "entry" among the Bundle's own keys
+    if scanner.skip_separators() != "{":
+        raise ValueError("Response is not a JSON object")
+    scanner.pos += 1
+    while True:
+        char = scanner.skip_separators()
+        if char == "}" or not char:
+            return # Bundle without entries
+        key = scanner.read_string()
+        scanner.skip_separators()
+        scanner.pos += 1 # ':'
+        char = scanner.skip_separators()
+        if key == "entry":
+            break
+        if char in "{[":
+            scanner.skip_value()
+        elif char == '"':
+            scanner.read_string()
+        else:
+            scanner.skip_scalar()
+    if char != "[":
+        raise ValueError("Bundle.entry is not an array")
+    scanner.pos += 1
+    while True:
+        char = scanner.skip_separators()
+        if char == "]" or not char:
+            return
+        scanner.skip_value()
+        text = scanner.buf[scanner.value_start:scanner.pos]
+        if resource_types:
+            # Skip without decoding only when the peek is unambiguous: a single resourceType in the entry.
+            # With contained or nested resources the first match needn't be the entry's own, so decode.
+            peek = _RESOURCE_TYPE.findall(text)
+            if len(peek) == 1 and peek[0] not in resource_types:
+                continue
+        resource = json.loads(text).get("resource")
+        if not resource:
+            continue
+        if resource_types and resource.get("resourceType") not in resource_types:
+            continue
+        if keep:
+            resource = {k: v for k, v in resource.items() if k in keep}
+        yield resource
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+
+## Bounded per-patient conversation memory for the Chat page.
+## - at most `max_patients` conversations per session; the least recently used patient is dropped
+## - at most `max_turns` verbatim turns per patient; older turns are rolled into a short summary
+## - the patient context block is cached per conversation and only rebuilt when its key changes
+##   (new data or new alerts), so follow-up questions reuse the same block. Keeping it identical
+##   across turns also keeps the prompt prefix stable for the API's prompt caching.
+## Summaries are extractive (clipped turns), so rolling history up never costs an extra LLM call.
+
+class Conversation:
+    __slots__ = ("turns", "summary", "context", "context_key")
+
+    def __init__(self):
+        self.turns = []
+        self.summary = []
+        self.context = None
+        self.context_key = None
+
+class ConversationMemory:
+    def __init__(self, max_patients=5, max_turns=10, keep_recent=6, max_turn_chars=4000,
+                 summary_line_chars=200, max_summary_lines=20):
+        self.max_patients = max_patients
+        self.max_turns = max_turns
+        self.keep_recent = keep_recent
+        self.max_turn_chars = max_turn_chars
+        self.summary_line_chars = summary_line_chars
+        self.max_summary_lines = max_summary_lines
+        self._conversations = OrderedDict()
+
+    def _lookup(self, pid):
+        # Read-only: viewing a patient must not create a conversation or evict another one
+        return self._conversations.get(pid)
+
+    def _get(self, pid):
+        """The patient's conversation, created if needed. Only the write paths (append, context) call this."""
+        conversation = self._conversations.get(pid)
+        if conversation is None:
+            conversation = self._conversations[pid] = Conversation()
+            while len(self._conversations) > self.max_patients:
+                self._conversations.popitem(last=False)
+        else:
+            self._conversations.move_to_end(pid)
+        return conversation
+
+    def append(self, pid, role, content):
+        conversation = self._get(pid)
+        conversation.turns.append({"role": role, "content": content[:self.max_turn_chars]})
+        if len(conversation.turns) > self.max_turns:
+            rolled = conversation.turns[:-self.keep_recent]
+            conversation.turns = conversation.turns[-self.keep_recent:]
+            speaker = {"user": "User asked", "assistant": "Assistant answered"}
+            for turn in rolled:
+                text = " ".join(turn["content"].split())
+                if len(text) > self.summary_line_chars:
+                    text = text[:self.summary_line_chars].rsplit(" ", 1)[0] + "…"
+                conversation.summary.append(f"- {speaker.get(turn['role'], turn['role'])}: {text}")
+            del conversation.summary[:-self.max_summary_lines]
+
+    def turns(self, pid):
+        conversation = self._lookup(pid)
+        return list(conversation.turns) if conversation else []
+
+    def summary(self, pid):
+        conversation = self._lookup(pid)
+        return "\n".join(conversation.summary) if conversation else ""
+
+    def prompt_history(self, pid):
+        """Messages to send before the new question: the rolled-up summary, then the recent turns."""
+        conversation = self._lookup(pid)
+        if conversation is None:
+            return []
+        messages = []
+        if conversation.summary:
+            messages.append({"role": "system", "content": "Summary of earlier conversation:\n" + "\n".join(conversation.summary)})
+        return messages + [dict(turn) for turn in conversation.turns]
+
+    def context(self, pid, key, build):
+        """Cached patient context block; `build()` only runs when `key` differs from the cached one."""
+        conversation = self._get(pid)
+        if conversation.context is None or conversation.context_key != key:
+            conversation.context = build()
+            conversation.context_key = key
+        return conversation.context
@@ -1,69 +1,10 @@
 import streamlit as st
-import pandas as pd
-from authlib.integrations.requests_client import OAuth2Session
-from urllib.parse import urlencode, urlparse, parse_qs
 
+import Auth
 import Utils
 
 import demoSettings
 
-AUTH0_AUTHORIZE_URL = f"https://{demoSettings.domain}/authorize"
-AUTH0_TOKEN_URL = f"https://{demoSettings.domain}/oauth/token"
-AUTH0_CLIENT_ID = demoSettings.client_id
-AUTH0_CLIENT_SECRET = demoSettings.client_secret
-AUTH0_CALLBACK_URL = "http://localhost:8501/"
-AUTH0_AUDIENCE = demoSettings.audience if hasattr(demoSettings, "audience") else None
-FHIR_BASE_URL = demoSettings.base_url
-MAPPINGS_PATH = demoSettings.mappings_path
-
-def get_authorize_url():
-    params = {
-        "client_id": AUTH0_CLIENT_ID,
-        "response_type": "code",
-        "redirect_uri": AUTH0_CALLBACK_URL,
-        "scope": "openid profile email",
-        "prompt": "login"
-    }
-    if AUTH0_AUDIENCE:
-        params["audience"] = AUTH0_AUDIENCE
-    return f"{AUTH0_AUTHORIZE_URL}?{urlencode(params)}"
-
-def get_token(code):
-    print("Exchanging code:", code)
-    print("Redirect URI:", AUTH0_CALLBACK_URL)
-    session = OAuth2Session(AUTH0_CLIENT_ID, AUTH0_CLIENT_SECRET, redirect_uri=AUTH0_CALLBACK_URL)
-    token = session.fetch_token(
-        AUTH0_TOKEN_URL,
-        code=code,
-        grant_type="authorization_code",
-        client_secret=AUTH0_CLIENT_SECRET,
-    )
-    return token
-
-def get_user_info(token):
-    import requests
-    headers = {"Authorization": f"Bearer {token['access_token']}"}
-    resp = requests.get(f"https://{demoSettings.domain}/userinfo", headers=headers)
-    return resp.json()
-
-def refresh_access_token():
-    refresh_token = st.session_state.get("refresh_token")
-    if not refresh_token:
-        st.error("No refresh token available. Please log in again.")
-        st.stop()
-    session = OAuth2Session(AUTH0_CLIENT_ID, AUTH0_CLIENT_SECRET, redirect_uri=AUTH0_CALLBACK_URL)
-    token = session.refresh_token(
-        AUTH0_TOKEN_URL,
-        refresh_token=refresh_token,
-        client_id=AUTH0_CLIENT_ID,
-        client_secret=AUTH0_CLIENT_SECRET,
-    )
-    st.session_state["access_token"] = token["access_token"]
-    if "expires_in" in token:
-        import time
-        st.session_state["token_expiry"] = time.time() + token["expires_in"]
-    return token["access_token"]
-
 st.title('Device Management Application')
 
 query_params = st.query_params 
@@ -71,15 +12,9 @@ query_params = st.query_params
 if "code" in query_params:
     code = query_params["code"]
     try:
-        token = get_token(code)
-        user_info = get_user_info(token)
-        st.session_state["user"] = user_info
-        st.session_state["access_token"] = token["access_token"] 
-        if "refresh_token" in token:
-            st.session_state["refresh_token"] = token["refresh_token"]
-        if "expires_in" in token:
-            import time
-            st.session_state["token_expiry"] = time.time() + token["expires_in"]
+        token = Auth.get_token(code)
+        user_info = Auth.get_user_info(token)
+        Auth.store_token(token, user_info)
         st.query_params.clear()  # Remove code from URL after use
         st.success(f"Logged in as {user_info['name']}")
     except Exception as e:
@@ -91,32 +26,62 @@ elif "user" in st.session_state:
     user_info = st.session_state["user"]
     st.write(f"Hello, {user_info['name']}!")
 else:
-    st.markdown(f'<a href="{get_authorize_url()}" target="_self"><button>Log in to continue</button></a>', unsafe_allow_html=True)
+    st.markdown(f'<a href="{Auth.get_authorize_url()}" target="_self"><button>Log in to continue</button></a>', unsafe_allow_html=True)
     st.sidebar.markdown("Log in to view authorized patients")
-    st.sidebar.markdown(f'<a href="{get_authorize_url()}" target="_self"><button>Log in to continue</button></a>', unsafe_allow_html=True)
+    st.sidebar.markdown(f'<a href="{Auth.get_authorize_url()}" target="_self"><button>Log in to continue</button></a>', unsafe_allow_html=True)
 
 if "user" in st.session_state:
+    # Heavy imports only once we know there's a logged-in user to render for
+    import pandas as pd
+    import Analytics
+    aggregates_path = demoSettings.aggregates_path if hasattr(demoSettings, "aggregates_path") else Analytics.AGGREGATES_PATH
+
     # Reveal the Patient dropdown (should be empty for unauthenticated user!)
     patient_id, selected_name = Utils.render_sidebar_patient_select()
     # Show total metrics
     st.markdown("## Metrics")
-    all_devices = Utils.get_total_devices()
+    sample_device_count, device_types = Utils.get_total_device_types()
     col1, col2 = st.columns(2)
     with col1:
-        st.metric(label="Total Patients", value=len(Utils.get_unique_patients()))
+        index = Utils.get_patient_index()
+        total_patients = len(index) if index is not None else Utils.get_resource_total("Patient")
+        st.metric(label="Total Patients", value=total_patients if total_patients is not None else "n/a")
     with col2:
-        st.metric(label="Total Devices", value=len(all_devices))
+        total_devices = Utils.get_resource_total("Device")
+        st.metric(label="Total Devices", value=total_devices if total_devices is not None else "n/a")
     
     st.markdown("## Devices")
-    device_types = []
-    for device in all_devices:
-        codings = device.get("type", {}).get("coding", [])
-        for coding in codings:
-            display = coding.get("display", "Unknown")
-            code = coding.get("code", "Unknown")
-            device_types.append((display, code))
+    st.caption(f"Device types for a sample of the first {len(Utils.get_unique_patients())} registry patients "
+               f"({sample_device_count} devices)")
     df = pd.DataFrame(device_types, columns=["Device Type", "Device Code"])
     count_df = df.value_counts().reset_index(name="Count")
     st.table(count_df)
 
+    # Precomputed by Analytics.py from $export / fakerDevices output, so this is just a file read
+    st.markdown("## Cohort Vitals")
+    aggregates = Analytics.load_aggregates(aggregates_path)
+    if aggregates:
+        st.caption(f"{aggregates['patients']} patients, generated {aggregates['generated_at']}")
+        vitals_df = pd.DataFrame([
+            {
+                "Code": code,
+                "Type": v["display"],
+                "Unit": v["unit"],
+                "Count": v["count"],
+                "Mean": round(v["mean"], 2),
+                "Median": round(v["quantiles"]["0.5"], 2),
+                "P95": round(v["quantiles"]["0.95"], 2),
+                "Out of Range %": round(100 * v["out_of_range_rate"], 1),
+            }
+            for code, v in aggregates["vitals"].items()
+        ])
+        st.dataframe(vitals_df, use_container_width=True)
+        readings_df = pd.DataFrame([
+            {"Device Type": device_type, "Devices": v["devices"], "Readings": v["readings"]}
+            for device_type, v in aggregates["device_types"].items()
+        ])
+        st.table(readings_df)
+    else:
+        st.info(f"No cohort aggregates found at {aggregates_path}. Run Analytics.py against an $export download to create them.")
+
 Utils.render_sidebar_bottom()
\ No newline at end of file
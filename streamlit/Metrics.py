@@ -0,0 +1,238 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+
+import requests
+
+## In-process instrumentation for outbound FHIR/LLM calls and cache lookups.
+## One Metrics instance per process (METRICS below), shared by all sessions. Exposed in the
+## sidebar debug panel and exportable as Prometheus text or JSON lines.
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+class Series:
+    __slots__ = ("count", "total_ms", "max_ms", "bytes", "sent_bytes", "tokens_in", "tokens_out", "buckets", "statuses")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.bytes = 0 # received
+        self.sent_bytes = 0
+        self.tokens_in = 0 # LLM prompt tokens, when the response reports usage
+        self.tokens_out = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.statuses = {}
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {} # (kind, endpoint) -> Series
+        self.cache = {} # function name -> [lookups, misses]
+        self._observers = []
+
+    def add_observer(self, observer):
+        """observer(kind, endpoint, elapsed_ms, status, size) is called for every recorded call, on the calling thread."""
+        self._observers.append(observer)
+
+    def record_call(self, kind, endpoint, elapsed_ms, status, size=0, sent=0, tokens_in=0, tokens_out=0):
+        with self._lock:
+            series = self.calls.get((kind, endpoint))
+            if series is None:
+                series = self.calls[(kind, endpoint)] = Series()
+            series.count += 1
+            series.total_ms += elapsed_ms
+            series.max_ms = max(series.max_ms, elapsed_ms)
+            series.bytes += size
+            series.sent_bytes += sent
+            series.tokens_in += tokens_in
+            series.tokens_out += tokens_out
+            series.buckets[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            series.statuses[str(status)] = series.statuses.get(str(status), 0) + 1
+        for observer in self._observers:
+            observer(kind, endpoint, elapsed_ms, status, size)
+
+    def record_cache_lookup(self, name):
+        with self._lock:
+            self.cache.setdefault(name, [0, 0])[0] += 1
+
+    def record_cache_miss(self, name):
+        with self._lock:
+            self.cache.setdefault(name, [0, 0])[1] += 1
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.cache.clear()
+
+    def summary(self):
+        """Rows for the debug panel, slowest endpoints first."""
+        with self._lock:
+            rows = [
+                {
+                    "Kind": kind,
+                    "Endpoint": endpoint,
+                    "Calls": s.count,
+                    "Avg ms": round(s.total_ms / s.count, 1),
+                    "p95 ms": _bucket_quantile(s.buckets, s.count, 0.95),
+                    "Max ms": round(s.max_ms, 1),
+                    "KB": round(s.bytes / 1024, 1),
+                    "Sent KB": round(s.sent_bytes / 1024, 1),
+                    "Tokens in/out": f"{s.tokens_in}/{s.tokens_out}" if s.tokens_in or s.tokens_out else "",
+                    "Status": ", ".join(f"{code}×{n}" for code, n in sorted(s.statuses.items())),
+                }
+                for (kind, endpoint), s in self.calls.items()
+            ]
+            cache_rows = [
+                {
+                    "Function": name,
+                    "Lookups": lookups,
+                    "Misses": misses,
+                    "Hit ratio": round(1 - misses / lookups, 3) if lookups else None,
+                }
+                for name, (lookups, misses) in self.cache.items()
+            ]
+        rows.sort(key=lambda r: r["Avg ms"] * r["Calls"], reverse=True)
+        return rows, cache_rows
+
+    def to_prometheus(self):
+        lines = [
+            "# TYPE fhir_app_call_latency_ms histogram",
+        ]
+        with self._lock:
+            for (kind, endpoint), s in self.calls.items():
+                labels = f'kind="{kind}",endpoint="{_escape(endpoint)}"'
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS_MS, s.buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f'fhir_app_call_latency_ms_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"fhir_app_call_latency_ms_sum{{{labels}}} {s.total_ms}")
+                lines.append(f"fhir_app_call_latency_ms_count{{{labels}}} {s.count}")
+            lines.append("# TYPE fhir_app_call_bytes_total counter")
+            for (kind, endpoint), s in self.calls.items():
+                lines.append(f'fhir_app_call_bytes_total{{kind="{kind}",endpoint="{_escape(endpoint)}"}} {s.bytes}')
+            lines.append("# TYPE fhir_app_call_sent_bytes_total counter")
+            for (kind, endpoint), s in self.calls.items():
+                lines.append(f'fhir_app_call_sent_bytes_total{{kind="{kind}",endpoint="{_escape(endpoint)}"}} {s.sent_bytes}')
+            lines.append("# TYPE fhir_app_call_tokens_total counter")
+            for (kind, endpoint), s in self.calls.items():
+                if s.tokens_in or s.tokens_out:
+                    labels = f'kind="{kind}",endpoint="{_escape(endpoint)}"'
+                    lines.append(f'fhir_app_call_tokens_total{{{labels},direction="prompt"}} {s.tokens_in}')
+                    lines.append(f'fhir_app_call_tokens_total{{{labels},direction="completion"}} {s.tokens_out}')
+            lines.append("# TYPE fhir_app_call_status_total counter")
+            for (kind, endpoint), s in self.calls.items():
+                for status, n in s.statuses.items():
+                    lines.append(f'fhir_app_call_status_total{{kind="{kind}",endpoint="{_escape(endpoint)}",status="{status}"}} {n}')
+            lines.append("# TYPE fhir_app_cache_lookups_total counter")
+            for name, (lookups, misses) in self.cache.items():
+                lines.append(f'fhir_app_cache_lookups_total{{function="{name}"}} {lookups}')
+            lines.append("# TYPE fhir_app_cache_misses_total counter")
+            for name, (lookups, misses) in self.cache.items():
+                lines.append(f'fhir_app_cache_misses_total{{function="{name}"}} {misses}')
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self):
+        now = time.time()
+        with self._lock:
+            records = [
+                {
+                    "ts": now, "type": "call", "kind": kind, "endpoint": endpoint, "count": s.count,
+                    "total_ms": s.total_ms, "max_ms": s.max_ms, "bytes": s.bytes, "sent_bytes": s.sent_bytes,
+                    "tokens_in": s.tokens_in, "tokens_out": s.tokens_out, "statuses": s.statuses,
+                    "buckets": dict(zip(["+Inf" if b == float("inf") else b for b in LATENCY_BUCKETS_MS], s.buckets)),
+                }
+                for (kind, endpoint), s in self.calls.items()
+            ]
+            records += [
+                {"ts": now, "type": "cache", "function": name, "lookups": lookups, "misses": misses}
+                for name, (lookups, misses) in self.cache.items()
+            ]
+        return "\n".join(json.dumps(r) for r in records) + "\n"
+
+def _bucket_quantile(buckets, count, q):
+    # Upper bound of the bucket holding the q-th call; good enough for spotting slow endpoints.
+    # Returned as text so the overflow bucket reads ">10000" rather than inf.
+    target = q * count
+    bound = LATENCY_BUCKETS_MS[-1]
+    seen = 0
+    for bucket_bound, n in zip(LATENCY_BUCKETS_MS, buckets):
+        seen += n
+        if seen >= target:
+            bound = bucket_bound
+            break
+    return f">{LATENCY_BUCKETS_MS[-2]}" if bound == float("inf") else str(bound)
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+METRICS = Metrics()
+
+def timed_get(endpoint, url, **kwargs):
+    """requests.get that records latency, payload size and status under `endpoint`."""
+    return timed_request("GET", endpoint, url, **kwargs)
+
+def timed_request(method, endpoint, url, **kwargs):
+    start = time.perf_counter()
+    try:
+        res = requests.request(method, url, **kwargs)
+    except requests.RequestException:
+        METRICS.record_call("fhir", endpoint, (time.perf_counter() - start) * 1000, "error")
+        raise
+    METRICS.record_call("fhir", endpoint, (time.perf_counter() - start) * 1000, res.status_code, len(res.content),
+                        sent=_body_size(res.request.body))
+    return res
+
+def _body_size(body):
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+def timed_stream(endpoint, url, chunk_size=1 << 16, **kwargs):
+    """Streaming GET. Returns (response, body chunks); the call is recorded once the body has been
+    read (or the consumer stops early), with the bytes actually received."""
+    start = time.perf_counter()
+    try:
+        res = requests.get(url, stream=True, **kwargs)
+    except requests.RequestException:
+        METRICS.record_call("fhir", endpoint, (time.perf_counter() - start) * 1000, "error")
+        raise
+
+    def chunks():
+        size = 0
+        try:
+            for chunk in res.iter_content(chunk_size):
+                size += len(chunk)
+                yield chunk
+        finally:
+            res.close()
+            METRICS.record_call("fhir", endpoint, (time.perf_counter() - start) * 1000, res.status_code, size)
+    return res, chunks()
+
+def timed_call(kind, endpoint, fn, *args, **kwargs):
+    """Call fn and record its latency, e.g. for LLM requests. Exceptions are recorded as status 'error'.
+
+    The keyword arguments are sized as the request payload; the result is sized from its JSON form
+    (pydantic models such as OpenAI responses), and token counts come from `result.usage` if present.
+    """
+    sent = len(json.dumps(kwargs, default=str))
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception:
+        METRICS.record_call(kind, endpoint, (time.perf_counter() - start) * 1000, "error", sent=sent)
+        raise
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    usage = getattr(result, "usage", None)
+    METRICS.record_call(
+        kind, endpoint, elapsed_ms, "ok", _result_size(result), sent=sent,
+        tokens_in=getattr(usage, "prompt_tokens", 0) or 0, tokens_out=getattr(usage, "completion_tokens", 0) or 0
+    )
+    return result
+
+def _result_size(result):
+    if hasattr(result, "model_dump_json"):
+        return len(result.model_dump_json())
+    if isinstance(result, (bytes, str)):
+        return len(result)
+    return 0
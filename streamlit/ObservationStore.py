@@ -0,0 +1,182 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from Vitals import first_coding, parse_effective
+
+## Process-wide, read-only store of compact per-patient observation and device data.
+## Observations are held as columnar NumPy arrays (code / display / unit as indexes into a shared
+## string pool, value, timestamp, device as an index into the patient's own device ids). Timestamps are
+## the source's wall-clock time, with the UTC offset kept alongside for ordering across offsets. Arrays are
+## marked read-only, so sessions get the same arrays (and views of them) instead of unpickled copies.
+## Memory is tracked per patient and the least recently used patients are evicted past `max_bytes`;
+## `on_evict(pid)` lets state derived from a patient's data (e.g. alerting) be dropped along with it.
+
+class StringPool:
+    """Interned strings for the small vocabulary of codes, displays and units."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = {}
+        self._strings = []
+        self._array = np.empty(0, dtype=object)
+
+    def intern(self, value):
+        value = value or ""
+        index = self._index.get(value)
+        if index is None:
+            with self._lock:
+                index = self._index.setdefault(value, len(self._strings))
+                if index == len(self._strings):
+                    self._strings.append(value)
+        return index
+
+    def take(self, indexes):
+        """Strings for an array of indexes, as an object array."""
+        if len(self._array) != len(self._strings):
+            self._array = np.array(self._strings, dtype=object)
+        return self._array[indexes]
+
+    def lookup(self, index):
+        return self._strings[index]
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+class DeviceRecord:
+    __slots__ = ("id", "text", "display", "code")
+
+    def __init__(self, resource):
+        coding = first_coding(resource.get("type"))
+        self.id = resource.get("id", "")
+        self.text = resource.get("type", {}).get("text", "Device")
+        self.display = coding.get("display", "Unknown")
+        self.code = coding.get("code", "Unknown")
+
+class PatientData:
+    """Read-only observation columns plus device records for one patient."""
+
+    def __init__(self, pool, resources, devices):
+        self.pool = pool
+        self.devices = tuple(DeviceRecord(d) for d in devices)
+        device_ids = []
+        device_index = {}
+        code, display, unit, value, timestamp, utc_offset, device = [], [], [], [], [], [], []
+        for obs in resources:
+            quantity = obs.get("valueQuantity", {})
+            if quantity.get("value") is None:
+                continue
+            try:
+                wall_seconds, offset = parse_effective(obs.get("effectiveDateTime"))
+            except ValueError:
+                continue # missing or malformed effectiveDateTime
+            coding = first_coding(obs.get("code"))
+            device_id = obs.get("device", {}).get("reference", "").split("/")[-1]
+            if device_id not in device_index:
+                device_index[device_id] = len(device_ids)
+                device_ids.append(device_id)
+            code.append(pool.intern(coding.get("code")))
+            display.append(pool.intern(coding.get("display")))
+            unit.append(pool.intern(quantity.get("unit")))
+            value.append(quantity["value"])
+            timestamp.append(int(wall_seconds))
+            utc_offset.append(offset)
+            device.append(device_index[device_id])
+        self.device_ids = tuple(device_ids)
+        self.code = _read_only(np.array(code, dtype=np.int32))
+        self.display = _read_only(np.array(display, dtype=np.int32))
+        self.unit = _read_only(np.array(unit, dtype=np.int32))
+        self.value = _read_only(np.array(value, dtype=np.float64))
+        self.timestamp = _read_only(np.array(timestamp, dtype="datetime64[s]")) # source wall-clock time
+        self.utc_offset = _read_only(np.array(utc_offset, dtype=np.int16)) # minutes
+        self.device = _read_only(np.array(device, dtype=np.int16 if len(device_ids) < 2 ** 15 else np.int32))
+
+    def __len__(self):
+        return len(self.value)
+
+    @property
+    def nbytes(self):
+        arrays = (self.code.nbytes + self.display.nbytes + self.unit.nbytes + self.value.nbytes
+                  + self.timestamp.nbytes + self.utc_offset.nbytes + self.device.nbytes)
+        records = sum(sys.getsizeof(r) + sum(sys.getsizeof(getattr(r, s)) for s in DeviceRecord.__slots__) for r in self.devices)
+        return arrays + records + sum(sys.getsizeof(d) for d in self.device_ids)
+
+    def utc_seconds(self):
+        """Epoch seconds (UTC) per reading, for ordering and rates across different offsets."""
+        return self.timestamp.astype(np.int64) - self.utc_offset.astype(np.int64) * 60
+
+    def type_names(self):
+        return sorted({self.pool.lookup(i) for i in np.unique(self.display).tolist()})
+
+    def type_mask(self, names):
+        wanted = [i for i in np.unique(self.display).tolist() if self.pool.lookup(i) in names]
+        return np.isin(self.display, wanted)
+
+    def device_column(self, mask=None):
+        device = self.device if mask is None else self.device[mask]
+        return np.array(self.device_ids, dtype=object)[device] if self.device_ids else np.empty(0, dtype=object)
+
+class ObservationStore:
+    def __init__(self, max_bytes=256 * 1024 * 1024, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.pool = StringPool()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # pid -> (key, PatientData, nbytes)
+        self._loading = {} # pid -> Lock, so concurrent sessions load a patient once
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, pid, key, load):
+        """Return PatientData for `pid`. `key` identifies the data version (e.g. Subscription generations);
+        on a miss or a changed key, `load(pool)` is called to build it."""
+        with self._lock:
+            entry = self._entries.get(pid)
+            if entry and entry[0] == key:
+                self._entries.move_to_end(pid)
+                self.hits += 1
+                return entry[1]
+            loading = self._loading.setdefault(pid, threading.Lock())
+        with loading:
+            with self._lock:
+                entry = self._entries.get(pid)
+                if entry and entry[0] == key:
+                    self.hits += 1
+                    return entry[1]
+                self.misses += 1
+            data = load(self.pool)
+            evicted_pids = []
+            with self._lock:
+                old = self._entries.pop(pid, None)
+                if old:
+                    self.bytes -= old[2]
+                size = data.nbytes
+                self._entries[pid] = (key, data, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes and len(self._entries) > 1:
+                    evicted_pid, (_, _, evicted) = self._entries.popitem(last=False)
+                    self.bytes -= evicted
+                    self.evictions += 1
+                    if evicted_pid not in self._loading: # a reload in progress replaces it anyway
+                        evicted_pids.append(evicted_pid)
+                self._loading.pop(pid, None)
+            if self.on_evict:
+                for evicted_pid in evicted_pids:
+                    self.on_evict(evicted_pid)
+            return data
+
+    def stats(self):
+        with self._lock:
+            return {
+                "Patients": len(self._entries),
+                "MB": round(self.bytes / (1024 * 1024), 2),
+                "Cap MB": round(self.max_bytes / (1024 * 1024)),
+                "Hits": self.hits,
+                "Misses": self.misses,
+                "Evictions": self.evictions,
+            }
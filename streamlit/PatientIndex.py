@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+## Compact local (id, display name) index for the sidebar patient picker.
+## Names are kept sorted and lowercased for prefix search, and also joined into one string so a
+## substring search is a single str.find scan in C rather than a Python loop over every patient.
+## No Streamlit imports here; Utils builds the index from Patient?_elements=name paging.
+
+SEPARATOR = "\n"
+
+logger = logging.getLogger(__name__)
+
+class PatientNameIndex:
+    def __init__(self, entries):
+        entries = sorted((name.lower(), name, pid) for pid, name in entries)
+        self._keys = [key for key, _, _ in entries]
+        self._names = [name for _, name, _ in entries]
+        self._ids = [pid for _, _, pid in entries]
+        self._haystack = SEPARATOR.join(self._keys)
+        # Start offset of each name inside the haystack, to map a match back to its entry
+        self._offsets = array("Q")
+        offset = 0
+        for key in self._keys:
+            self._offsets.append(offset)
+            offset += len(key) + len(SEPARATOR)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _entry(self, i):
+        return self._ids[i], self._names[i]
+
+    def page(self, start=0, limit=50):
+        return [self._entry(i) for i in range(start, min(start + limit, len(self)))]
+
+    def search(self, query, limit=50):
+        """Prefix matches first (in name order), then substring matches, up to `limit` results."""
+        query = query.strip().lower()
+        if not query:
+            return self.page(0, limit)
+        lo = bisect_left(self._keys, query)
+        hi = bisect_right(self._keys, query + "\uffff")
+        results = [self._entry(i) for i in range(lo, min(hi, lo + limit))]
+        seen = set()
+        pos = self._haystack.find(query)
+        while pos != -1 and len(results) < limit:
+            i = bisect_right(self._offsets, pos) - 1
+            if not lo <= i < hi and i not in seen:
+                seen.add(i)
+                results.append(self._entry(i))
+            # Skip to the next name so one patient is only matched once
+            pos = self._haystack.find(query, self._offsets[i] + len(self._keys[i]) + len(SEPARATOR))
+        return results
+
+class BackgroundIndex:
+    """Builds a PatientNameIndex on a daemon thread so no page render waits for the full paging.
+
+    `get(load)` returns None until the index is ready. `load()` runs on the build thread and must
+    return every (id, name) entry or raise; a build that fails partway is thrown away and retried
+    on a later `get` after `retry_seconds`, so a partial index is never served.
+    """
+
+    def __init__(self, retry_seconds=60):
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._index = None
+        self._building = False
+        self._failed_at = None
+
+    def get(self, load):
+        if self._index is not None:
+            return self._index
+        with self._lock:
+            retry_due = self._failed_at is None or time.monotonic() - self._failed_at >= self.retry_seconds
+            if self._index is None and not self._building and retry_due:
+                self._building = True
+                threading.Thread(target=self._build, args=(load,), name="patient-index", daemon=True).start()
+        return self._index
+
+    def _build(self, load):
+        index = None
+        try:
+            index = PatientNameIndex(load())
+        except Exception:
+            logger.exception("Patient name index build failed; serving server-side search until a retry succeeds")
+        with self._lock:
+            self._index = index
+            self._failed_at = None if index is not None else time.monotonic()
+            self._building = False
@@ -0,0 +1,62 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+## Background prefetch of patient data into the shared caches.
+## A small fixed pool works through the patients that sessions are likely to open next. Each session
+## has its own wanted list; retargeting (e.g. on a patient switch) only replaces that session's list,
+## and queued work is cancelled once no session wants the patient any more. A running task also
+## stops between fetches when its patient is no longer wanted.
+## Nothing is kept here beyond the wanted lists: memory is bounded by the caches being warmed.
+
+logger = logging.getLogger(__name__)
+
+class Prefetcher:
+    def __init__(self, max_workers=2, max_pending=8, max_sessions=100):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._pending = OrderedDict() # pid -> Future
+        self._wanted = OrderedDict() # session -> set of pids, least recently retargeted first
+
+    def retarget(self, session, pids, fetchers):
+        """Prefetch `pids` (most important first) for `session` with each of `fetchers(pid)`,
+        replacing that session's earlier request."""
+        pids = [pid for pid in dict.fromkeys(pids)][:self.max_pending]
+        with self._lock:
+            self._wanted.pop(session, None)
+            self._wanted[session] = set(pids)
+            while len(self._wanted) > self.max_sessions:
+                self._wanted.popitem(last=False) # sessions that went quiet
+            for pid, future in list(self._pending.items()):
+                if not self._is_wanted(pid) and future.cancel():
+                    del self._pending[pid]
+            for pid in pids:
+                if pid not in self._pending:
+                    self._pending[pid] = self.executor.submit(self._run, pid, list(fetchers))
+
+    def _is_wanted(self, pid):
+        # Caller holds the lock
+        return any(pid in pids for pids in self._wanted.values())
+
+    def wanted(self, pid):
+        with self._lock:
+            return self._is_wanted(pid)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self, pid, fetchers):
+        try:
+            for fetch in fetchers:
+                if not self.wanted(pid):
+                    return # every session moved on; don't spend the pool on it
+                fetch(pid)
+        except Exception:
+            logger.exception(f"Prefetch failed for Patient/{pid}")
+        finally:
+            with self._lock:
+                self._pending.pop(pid, None)
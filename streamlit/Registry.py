@@ -0,0 +1,172 @@
+import csv
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows: no cross-process locking, compile once up front instead
+    fcntl = None
+
+## Compact, memory-mapped index of the resource ids in mappings_2.csv.
+## The CSV is compiled once into <csv>.registry/, one pair of files per resource type:
+##   <type>.ids  sorted 16-byte UUIDs
+##   <type>.ver  version ids as little-endian uint32, in the same order
+## Files are mapped read-only, so every Streamlit process (and fakerDevices) shares the same
+## pages through the OS cache instead of holding its own lists of UUID strings.
+## This module must stay free of Streamlit imports so bulk scripts can use it too.
+
+ID_SIZE = 16
+VERSION_SIZE = 4
+MANIFEST = "manifest.json"
+
+def registry_path(csv_path):
+    return csv_path + ".registry"
+
+@contextmanager
+def _locked(out_dir, exclusive):
+    """Advisory lock shared by every process using this registry: readers open the registry under a shared
+    lock, compiles hold it exclusively, so nobody sees the directory while it is being swapped."""
+    if fcntl is None:
+        yield
+        return
+    with open(out_dir + ".lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def compile_registry(csv_path, out_dir=None):
+    """Compile the mappings CSV into the binary registry. Duplicate ids keep their highest version."""
+    out_dir = out_dir or registry_path(csv_path)
+    with _locked(out_dir, exclusive=True):
+        return _compile(csv_path, out_dir)
+
+def _compile(csv_path, out_dir):
+    by_type = {}
+    with open(csv_path, newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            try:
+                key = uuid.UUID(row['resource_id']).bytes
+            except ValueError:
+                raise ValueError(f"Resource id is not a UUID: {row['resource_type']}/{row['resource_id']}")
+            version = int(row.get('version_id') or 1)
+            ids = by_type.setdefault(row['resource_type'], {})
+            if version > ids.get(key, 0):
+                ids[key] = version
+
+    # Write into a private temp dir and swap it in, so readers never see a half-written registry
+    parent, name = os.path.split(os.path.abspath(out_dir))
+    tmp_dir = tempfile.mkdtemp(prefix=name + ".tmp", dir=parent)
+    try:
+        manifest = {"source_mtime": os.path.getmtime(csv_path), "types": {}}
+        for resource_type, ids in by_type.items():
+            keys = sorted(ids)
+            with open(os.path.join(tmp_dir, f"{resource_type}.ids"), "wb") as f:
+                f.write(b"".join(keys))
+            with open(os.path.join(tmp_dir, f"{resource_type}.ver"), "wb") as f:
+                f.write(struct.pack(f"<{len(keys)}I", *(ids[k] for k in keys)))
+            manifest["types"][resource_type] = len(keys)
+        with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+            json.dump(manifest, f)
+        os.chmod(tmp_dir, 0o755) # mkdtemp creates it private to this user
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+def _is_stale(csv_path, out_dir):
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return True
+    if not os.path.exists(csv_path):
+        return False  # registry shipped without the CSV
+    with open(manifest_path) as f:
+        return json.load(f)["source_mtime"] != os.path.getmtime(csv_path)
+
+def open_registry(csv_path):
+    """Open the registry for a mappings CSV, compiling it first if it is missing or out of date."""
+    out_dir = registry_path(csv_path)
+    with _locked(out_dir, exclusive=False):
+        if not _is_stale(csv_path, out_dir):
+            return ResourceRegistry(out_dir)
+    with _locked(out_dir, exclusive=True):
+        # Another process may have compiled it while we waited for the lock
+        if _is_stale(csv_path, out_dir):
+            _compile(csv_path, out_dir)
+        return ResourceRegistry(out_dir)
+
+def _map(path):
+    if os.path.getsize(path) == 0:
+        return b""  # mmap can't map empty files
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _format_id(raw):
+    return str(uuid.UUID(bytes=bytes(raw))).upper()
+
+class ResourceRegistry:
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.counts = json.load(f)["types"]
+        self._ids = {}
+        self._versions = {}
+        for resource_type in self.counts:
+            self._ids[resource_type] = _map(os.path.join(path, f"{resource_type}.ids"))
+            self._versions[resource_type] = _map(os.path.join(path, f"{resource_type}.ver"))
+
+    def types(self):
+        return list(self.counts)
+
+    def count(self, resource_type):
+        return self.counts.get(resource_type, 0)
+
+    def _find(self, resource_type, resource_id):
+        # Binary search over the mapped id array: O(log n), no per-id Python objects
+        try:
+            key = uuid.UUID(resource_id).bytes
+        except ValueError:
+            return -1
+        data = self._ids.get(resource_type)
+        lo, hi = 0, self.count(resource_type)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = data[mid * ID_SIZE:(mid + 1) * ID_SIZE]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def contains(self, resource_type, resource_id):
+        return self._find(resource_type, resource_id) >= 0
+
+    def version(self, resource_type, resource_id):
+        index = self._find(resource_type, resource_id)
+        if index < 0:
+            return None
+        return struct.unpack_from("<I", self._versions[resource_type], index * VERSION_SIZE)[0]
+
+    def ids(self, resource_type, start=0, stop=None):
+        """Return ids [start:stop] for a type as strings. Only the requested slice is decoded."""
+        start, stop, _ = slice(start, stop).indices(self.count(resource_type))
+        data = self._ids.get(resource_type, b"")
+        return [_format_id(data[i * ID_SIZE:(i + 1) * ID_SIZE]) for i in range(start, stop)]
+
+    def page(self, resource_type, page, page_size=100):
+        return self.ids(resource_type, page * page_size, (page + 1) * page_size)
+
+    def iter_ids(self, resource_type, batch_size=10000):
+        for start in range(0, self.count(resource_type), batch_size):
+            yield from self.ids(resource_type, start, start + batch_size)
@@ -0,0 +1,228 @@
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+## FHIR Subscription (rest-hook) receiver used to invalidate cached patient data.
+## Utils registers one Subscription per (resource type, patient) pointing at
+##   <endpoint>/<resourceType>/<patient id>
+## so even an empty-payload notification says exactly which cache entries are stale.
+## The receiver runs on a daemon thread next to Streamlit and bumps a per-(patient, type) generation
+## number; cached fetches include that number in their key, so only the affected patient refetches.
+## Notifications must carry the shared secret that was sent in the Subscription's channel.header.
+## A payload whose resources all belong to some other patient is ignored.
+## One receiver per host: the Streamlit process that binds the port owns the Subscriptions (registers,
+## renews and deletes them). Generations are per process, so any other process on the host gets no
+## notifications and relies on its Refresh buttons.
+
+NOTIFY_PATH = "/fhir-notify"
+NOTIFY_TYPES = ("Device", "Observation")
+PATIENT_SEARCH_PARAM = {"Device": "patient", "Observation": "subject"}
+MAX_NOTIFICATION_BYTES = 10 * 1024 * 1024
+
+def load_secret(path):
+    """Read the notification secret from `path`, creating it on first use.
+
+    Kept on disk so the Subscriptions already on the server stay valid across restarts.
+    """
+    try:
+        with open(path) as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(secrets.token_urlsafe(32))
+    try:
+        os.link(tmp_path, path) # atomic, and fails if another process got there first
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp_path)
+    with open(path) as f:
+        return f.read().strip()
+
+def authorization_header(secret):
+    return f"Authorization: Bearer {secret}"
+
+def references_patient(resource, pid):
+    reference = (resource.get(PATIENT_SEARCH_PARAM.get(resource.get("resourceType"), "subject")) or {}).get("reference", "")
+    parts = reference.split("/")
+    return "Patient" in parts and parts.index("Patient") + 1 < len(parts) and parts[parts.index("Patient") + 1] == pid
+
+class SubscriptionHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generations = {}
+        self.receiving = False # set once this process's receiver is listening
+
+    def generation(self, pid, resource_type):
+        with self._lock:
+            return self._generations.get((pid, resource_type), 0)
+
+    def invalidate(self, pid, resource_type):
+        with self._lock:
+            # ("*", type) tracks any change of that type, for cohort-wide results like get_total_devices
+            for key in ((pid, resource_type), ("*", resource_type)):
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+def notification_resources(body):
+    """Changed resources carried by a notification: an R4 history Bundle, an R4B/R5
+    subscription-notification Bundle (SubscriptionStatus entries are skipped), or a bare resource."""
+    if not body:
+        return []
+    payload = json.loads(body)
+    if payload.get("resourceType") != "Bundle":
+        return [payload]
+    return [
+        entry["resource"] for entry in payload.get("entry", [])
+        if entry.get("resource") and entry["resource"].get("resourceType") != "SubscriptionStatus"
+    ]
+
+def _make_handler(hub, secret):
+    expected = f"Bearer {secret}"
+
+    class NotificationHandler(BaseHTTPRequestHandler):
+        def _reply(self, status):
+            self.send_response(status)
+            self.end_headers()
+
+        def do_POST(self):
+            if not hmac.compare_digest(self.headers.get("Authorization", ""), expected):
+                return self._reply(401)
+            parts = self.path.split("?")[0].rstrip("/").split("/")
+            # .../fhir-notify/<resourceType>/<pid>
+            if len(parts) < 3 or "/".join(parts[:-2]) != NOTIFY_PATH or parts[-2] not in NOTIFY_TYPES:
+                return self._reply(404)
+            resource_type, pid = parts[-2], parts[-1]
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                return self._reply(400)
+            if length > MAX_NOTIFICATION_BYTES:
+                return self._reply(413)
+            try:
+                resources = notification_resources(self.rfile.read(length))
+            except (ValueError, AttributeError):
+                return self._reply(400)
+            # An empty payload still names the patient in the path; a payload that only carries
+            # other patients' resources doesn't touch this patient's cache
+            if not resources or any(
+                isinstance(r, dict) and r.get("resourceType") == resource_type and references_patient(r, pid)
+                for r in resources
+            ):
+                hub.invalidate(pid, resource_type)
+            self._reply(200)
+
+        def log_message(self, format, *args):
+            pass # keep notification traffic out of the Streamlit console
+
+    return NotificationHandler
+
+class SubscriptionReceiver:
+    def __init__(self, hub, secret, host="127.0.0.1", port=8502):
+        self.hub = hub
+        self.server = ThreadingHTTPServer((host, port), _make_handler(hub, secret))
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def subscription_criteria(resource_type, pid):
+    return f"{resource_type}?{PATIENT_SEARCH_PARAM[resource_type]}=Patient/{pid}"
+
+def subscription_endpoint(resource_type, pid, endpoint):
+    return f"{endpoint.rstrip('/')}/{resource_type}/{pid}"
+
+def subscription_query(resource_type, pid, endpoint):
+    """Search matching this app's Subscription for a patient, for conditional update and delete."""
+    criteria = quote(subscription_criteria(resource_type, pid), safe="")
+    url = quote(subscription_endpoint(resource_type, pid, endpoint), safe="")
+    return f"criteria={criteria}&url={url}"
+
+def build_subscription(resource_type, pid, endpoint, headers=None, ttl_seconds=None):
+    subscription = {
+        "resourceType": "Subscription",
+        "status": "requested",
+        "reason": "Invalidate cached patient data in the Streamlit app",
+        "criteria": subscription_criteria(resource_type, pid),
+        "channel": {
+            "type": "rest-hook",
+            "endpoint": subscription_endpoint(resource_type, pid, endpoint),
+            "payload": "application/fhir+json",
+        },
+    }
+    if headers:
+        subscription["channel"]["header"] = headers
+    if ttl_seconds:
+        # The server turns it off by itself if it isn't renewed, e.g. after a crash
+        subscription["end"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl_seconds))
+    return subscription
+
+class SubscriptionRegistrations:
+    """Patients the receiving process holds Subscriptions for, least recently renewed first."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._renewed = {} # pid -> time.monotonic() of the last successful registration
+
+    def due(self, pid, renew_seconds):
+        with self._lock:
+            renewed = self._renewed.get(pid)
+        return renewed is None or time.monotonic() - renewed >= renew_seconds
+
+    def mark(self, pid, max_patients):
+        """Record a successful registration; returns the patients pushed out past `max_patients`."""
+        with self._lock:
+            self._renewed.pop(pid, None)
+            self._renewed[pid] = time.monotonic()
+            evicted = list(self._renewed)[:max(0, len(self._renewed) - max_patients)]
+            for old in evicted:
+                del self._renewed[old]
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            pids = list(self._renewed)
+            self._renewed.clear()
+        return pids
+
+class StubNotifier:
+    """Sends notifications to a receiver the way a FHIR server would, for tests and local demos."""
+
+    def __init__(self, receiver_url, secret):
+        self.receiver_url = receiver_url.rstrip("/")
+        self.secret = secret
+
+    def notify(self, resource_type, pid, resources=()):
+        body = b""
+        if resources:
+            body = json.dumps({
+                "resourceType": "Bundle",
+                "type": "history",
+                "entry": [{"resource": r} for r in resources],
+            }).encode()
+        request = urllib.request.Request(
+            f"{self.receiver_url}{NOTIFY_PATH}/{resource_type}/{pid}",
+            data=body, method="POST",
+            headers={"Content-Type": "application/fhir+json", "Authorization": f"Bearer {self.secret}"}
+        )
+        with urllib.request.urlopen(request) as response:
+            return response.status
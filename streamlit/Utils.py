@@ -1,26 +1,80 @@
 import streamlit as st
-import requests
-import time
+import atexit
 import base64
 import json
-import csv
 import re
+import functools
+import logging
+import os
+import threading
+from urllib.parse import quote
 
 import demoSettings
+import Auth
+import Registry
+import Alerts
+from Metrics import METRICS, timed_get, timed_request, timed_stream
+from BundleStream import iter_bundle_resources
+from PatientIndex import BackgroundIndex
+import Subscriptions
+import Prefetch
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 FHIR_BASE_URL = demoSettings.base_url
 MAPPINGS_PATH = demoSettings.mappings_path
 
 DEBUG_BASIC_AUTH = True
 
-def get_valid_access_token():
-    from Home import refresh_access_token
-    expiry = st.session_state.get("token_expiry")
-    if expiry and time.time() > expiry:
-        return refresh_access_token()
-    return st.session_state.get("access_token")
+# Public URL the FHIR server can reach for rest-hook notifications, e.g. "http://app-host:8502/fhir-notify".
+# Subscriptions are off (Refresh buttons only) when this isn't set. Run one Streamlit process per host:
+# only the process that binds SUBSCRIPTION_PORT registers Subscriptions and sees notifications.
+SUBSCRIPTION_ENDPOINT = demoSettings.subscription_endpoint if hasattr(demoSettings, "subscription_endpoint") else None
+SUBSCRIPTION_PORT = demoSettings.subscription_port if hasattr(demoSettings, "subscription_port") else 8502
+# Only reachable from this host unless configured (e.g. "0.0.0.0" when the FHIR server is elsewhere)
+SUBSCRIPTION_HOST = demoSettings.subscription_host if hasattr(demoSettings, "subscription_host") else "127.0.0.1"
+# Shared secret the FHIR server sends back on every notification; generated into this file if not configured
+SUBSCRIPTION_SECRET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".subscription_secret")
+SUBSCRIPTION_TTL_SECONDS = 24 * 3600 # Subscription.end, so abandoned Subscriptions switch themselves off
+SUBSCRIPTION_RENEW_SECONDS = 3600
+SUBSCRIPTION_MAX_PATIENTS = 500 # the least recently viewed patient's Subscriptions are deleted
+UPDATE_CHECK_SECONDS = 5 # how often open pages check the in-process generation counters (no FHIR calls)
+
+PATIENT_PAGE_SIZE = 1000 # _count used when paging Patient?_elements=name into the name index
+PATIENT_PICKER_LIMIT = 50 # max options shown in the sidebar selectbox
+PATIENT_INDEX_RETRY_SECONDS = 60 # wait before rebuilding the name index after a failed build
+RESOURCE_TOTAL_TTL = 300
+
+PATIENT_CACHE_ENTRIES = 500 # per cached per-patient fetch; bounds what prefetch can add to the cache
+OBSERVATION_STORE_MB = demoSettings.observation_store_mb if hasattr(demoSettings, "observation_store_mb") else 256
+OBSERVATION_ELEMENTS = ["code", "valueQuantity", "effectiveDateTime", "device"] # all the Dashboard needs
+PREFETCH_WORKERS = 2
+PREFETCH_NEIGHBOURS = 2 # patients either side of the selection in the picker
+PREFETCH_RECENT = 3 # recently viewed patients kept warm
+PREFETCH_STARTUP = 5 # first patients in the picker warmed when the process starts
+
+logger = logging.getLogger(__name__)
+
+# Set on threads doing background work (index build, prefetch) for a session. They have no
+# script context: auth headers are captured up front and warnings go to the log, not to a page.
+_background = threading.local()
+
+def run_in_background(headers, fn, *args):
+    _background.headers = headers
+    try:
+        return fn(*args)
+    finally:
+        _background.headers = None
+
+def warn(message):
+    if getattr(_background, "headers", None) is not None:
+        logger.warning(message)
+    else:
+        st.warning(message)
 
 def auth_headers():
+    background_headers = getattr(_background, "headers", None)
+    if background_headers is not None:
+        return dict(background_headers)
     if DEBUG_BASIC_AUTH:
         user_pass = "SuperUser:irisowner"
         basic_auth = base64.b64encode(user_pass.encode()).decode()
@@ -29,50 +83,45 @@ def auth_headers():
             "Accept": "application/fhir+json"
         }
     else:
-        ACCESS_TOKEN = get_valid_access_token()
+        ACCESS_TOKEN = Auth.get_valid_access_token()
         headers = {
             "Authorization": f"Bearer {ACCESS_TOKEN}",
             "Accept": "application/fhir+json"
         }
     return headers
 
-@st.cache_data
-def load_resource_ids():
-    resource_ids = {}
-    with open(MAPPINGS_PATH, newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            resource_type = row['resource_type']
-            resource_id = row['resource_id']
-            resource_ids.setdefault(resource_type, []).append(resource_id)
-    return resource_ids
+def instrumented_cache(func=None, **cache_kwargs):
+    """st.cache_data that also counts lookups and misses for the performance panel.
 
-@st.cache_data
-def get_patients(max = 150):
-    unique_patient_ids = get_unique_patients(max)
-    patients = []
-    for pid in unique_patient_ids:
-        url = f"{FHIR_BASE_URL}/Patient/{pid}"
-        res = requests.get(url, headers=auth_headers())
-        if res.status_code == 200:
-            patients.append(res.json())
-        else:
-            st.warning(f"Failed to fetch Patient/{pid}: {res.status_code}")
-    return patients
+    Use bare, or with st.cache_data arguments: @instrumented_cache(max_entries=100)
+    """
+    if func is None:
+        return functools.partial(instrumented_cache, **cache_kwargs)
+    name = func.__name__
 
-@st.cache_data
+    @functools.wraps(func)
+    def body(*args, **kwargs):
+        # Only runs on a cache miss
+        METRICS.record_cache_miss(name)
+        return func(*args, **kwargs)
+    cached = st.cache_data(body, **cache_kwargs)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        METRICS.record_cache_lookup(name)
+        return cached(*args, **kwargs)
+    wrapper.clear = cached.clear
+    return wrapper
+
+@st.cache_resource
+def get_registry():
+    # One memory-mapped registry per process, shared by every session (see Registry.py)
+    return Registry.open_registry(MAPPINGS_PATH)
+
+@instrumented_cache
 def get_unique_patients(max = 150):
-    resource_ids = load_resource_ids() # streamlit cache should pull the same id list into context without reading CSV
-    patient_ids = resource_ids.get("Patient", [])[:max]
-    unique_patient_ids = []
-    seen = set()
-    for pid in patient_ids:
-        if pid not in seen:
-            unique_patient_ids.append(pid)
-            seen.add(pid)
-        if len(unique_patient_ids) == max:
-            break
-    return unique_patient_ids
+    # Registry ids are already unique per type, so this is just a slice
+    return get_registry().ids("Patient", 0, max)
 
 def get_patient_display_name(patient):
     # Try to use the first name entry
@@ -83,7 +132,7 @@ def get_patient_display_name(patient):
         if "text" in name:
             return name["text"]
         # Otherwise, build from given/family
-        given = name.get("given", [])[0]
+        given = (name.get("given") or [""])[0]
         family = name.get("family", "")
         full_name = re.sub(r'\d+', '', f"{given} {family}").strip()
         if full_name:
@@ -91,85 +140,327 @@ def get_patient_display_name(patient):
     # Fallback to ID
     return patient.get("id", "Unknown")
 
-@st.cache_data
+@st.cache_resource
+def get_subscription_secret():
+    if hasattr(demoSettings, "subscription_secret"):
+        return demoSettings.subscription_secret
+    return Subscriptions.load_secret(SUBSCRIPTION_SECRET_PATH)
+
+@st.cache_resource
+def get_subscription_hub():
+    # Notifications only bump generations; alerting picks up the new readings when the store reloads
+    hub = Subscriptions.SubscriptionHub()
+    if SUBSCRIPTION_ENDPOINT:
+        try:
+            Subscriptions.SubscriptionReceiver(
+                hub, get_subscription_secret(), host=SUBSCRIPTION_HOST, port=SUBSCRIPTION_PORT).start()
+            hub.receiving = True
+        except OSError:
+            # Usually another Streamlit process on this host already owns the port (and the Subscriptions)
+            logger.exception(f"Subscription receiver could not listen on {SUBSCRIPTION_HOST}:{SUBSCRIPTION_PORT}; "
+                             "using Refresh buttons only")
+    return hub
+
+@st.cache_resource
+def get_subscription_registrations():
+    registrations = Subscriptions.SubscriptionRegistrations()
+    atexit.register(deregister_all_subscriptions, registrations)
+    return registrations
+
+def subscription_url(resource_type, pid):
+    return f"{FHIR_BASE_URL}/Subscription?{Subscriptions.subscription_query(resource_type, pid, SUBSCRIPTION_ENDPOINT)}"
+
+def ensure_subscriptions(pid):
+    """Register (or renew) this patient's Device and Observation Subscriptions.
+
+    A conditional update on criteria + endpoint creates the Subscription only if the server has none,
+    so a restart reuses the same one instead of piling up duplicates. Only the process whose receiver
+    is listening registers; the Subscriptions are its to renew and delete.
+    """
+    if not SUBSCRIPTION_ENDPOINT or not get_subscription_hub().receiving:
+        return
+    registrations = get_subscription_registrations()
+    if not registrations.due(pid, SUBSCRIPTION_RENEW_SECONDS):
+        return
+    headers = [Subscriptions.authorization_header(get_subscription_secret())]
+    registered = True
+    for resource_type in Subscriptions.NOTIFY_TYPES:
+        subscription = Subscriptions.build_subscription(
+            resource_type, pid, SUBSCRIPTION_ENDPOINT, headers=headers, ttl_seconds=SUBSCRIPTION_TTL_SECONDS)
+        for attempt in range(2):
+            res = timed_request("PUT", "Subscription?criteria&url", subscription_url(resource_type, pid),
+                                headers={**auth_headers(), "Content-Type": "application/fhir+json"}, json=subscription)
+            if res.status_code != 412 or attempt:
+                break
+            # More than one match (duplicates from older versions): clear them out and register once
+            delete_subscription(resource_type, pid)
+        if res.status_code not in (200, 201):
+            registered = False # retried on the next fetch for this patient
+            warn(f"Failed to register {resource_type} Subscription for Patient/{pid}: {res.status_code}")
+    if registered:
+        for evicted in registrations.mark(pid, SUBSCRIPTION_MAX_PATIENTS):
+            deregister_subscriptions(evicted)
+
+def delete_subscription(resource_type, pid):
+    res = timed_request("DELETE", "Subscription?criteria&url", subscription_url(resource_type, pid), headers=auth_headers())
+    if res.status_code not in (200, 202, 204, 404):
+        logger.warning(f"Failed to delete {resource_type} Subscription for Patient/{pid}: {res.status_code}")
+
+def deregister_subscriptions(pid):
+    # Registered again on this patient's next fetch
+    for resource_type in Subscriptions.NOTIFY_TYPES:
+        delete_subscription(resource_type, pid)
+
+def deregister_all_subscriptions(registrations):
+    # Runs at interpreter exit, outside any session
+    for pid in registrations.clear():
+        try:
+            deregister_subscriptions(pid)
+        except Exception:
+            logger.exception(f"Failed to deregister Subscriptions for Patient/{pid}")
+
+def invalidate_patient(pid, resource_type):
+    get_subscription_hub().invalidate(pid, resource_type)
+
 def get_devices(pid):
+    ensure_subscriptions(pid)
+    return fetch_devices(pid, get_subscription_hub().generation(pid, "Device"))
+
+@instrumented_cache(max_entries=PATIENT_CACHE_ENTRIES)
+def fetch_devices(pid, generation = 0):
+    # `generation` only keys the cache; it changes when a notification (or Refresh) invalidates this patient
     url = f"{FHIR_BASE_URL}/Device?patient=Patient/{pid}"
-    res = requests.get(url, headers=auth_headers())
-    devices = []
-    if res.status_code == 200:
-        bundle = res.json()
-        # Extract the "resource" from each entry in the bundle
-        for entry in bundle.get("entry", []):
-            resource = entry.get("resource")
-            if resource:
-                devices.append(resource)
-    else:
-        st.warning(f"Failed to fetch Devices for Patient/{pid}: {res.status_code}")
-    return devices
+    return list(iter_bundle("Device?patient", url, f"Devices for Patient/{pid}", resource_types={"Device"}))
 
-@st.cache_data
 def get_total_devices():
+    return fetch_total_devices(get_subscription_hub().generation("*", "Device"))
+
+@instrumented_cache
+def fetch_total_devices(generation = 0):
     unique_patient_ids = get_unique_patients()
     total_devices = []
+    hub = get_subscription_hub()
     for pid in unique_patient_ids:
-        devices = get_devices(pid)
+        # Straight to the cached fetch: a cohort count shouldn't register Subscriptions for every patient
+        devices = fetch_devices(pid, hub.generation(pid, "Device"))
         total_devices += devices
     return total_devices
 
-@st.cache_data
+def get_total_device_types():
+    return fetch_total_device_types(get_subscription_hub().generation("*", "Device"))
+
+@instrumented_cache
+def fetch_total_device_types(generation = 0):
+    # (device count, [(display, code), ...]) - what Home needs, without pickling every Device resource per rerun
+    devices = get_total_devices()
+    types = [
+        (coding.get("display", "Unknown"), coding.get("code", "Unknown"))
+        for device in devices for coding in device.get("type", {}).get("coding", [])
+    ]
+    return len(devices), types
+
+@st.cache_resource
+def get_observation_store():
+    import ObservationStore # numpy is only needed once a page actually shows patient data
+    # Alerting state is derived from the stored readings, so it goes when the patient does
+    return ObservationStore.ObservationStore(max_bytes=OBSERVATION_STORE_MB * 1024 * 1024,
+                                             on_evict=get_anomaly_detector().forget)
+
+def get_patient_data(pid):
+    """Compact, read-only observation columns and device records for a patient (see ObservationStore.py).
+
+    Shared by every session in the process; callers must not modify the arrays.
+    """
+    ensure_subscriptions(pid)
+    hub = get_subscription_hub()
+    key = (hub.generation(pid, "Observation"), hub.generation(pid, "Device"))
+    return get_observation_store().get(pid, key, lambda pool: load_patient_data(pid, pool))
+
+def load_patient_data(pid, pool):
+    # Built straight from the streamed Bundles, so the full resources are never held at once
+    observations = iter_bundle("Observation?subject", f"{FHIR_BASE_URL}/Observation?subject=Patient/{pid}",
+                               f"Observations for Patient/{pid}", {"Observation"}, OBSERVATION_ELEMENTS)
+    devices = iter_bundle("Device?patient", f"{FHIR_BASE_URL}/Device?patient=Patient/{pid}",
+                          f"Devices for Patient/{pid}", {"Device"})
+    import ObservationStore
+    data = ObservationStore.PatientData(pool, observations, devices)
+    # The only place alerting is fed, so every reading reaches it once and with the same timestamp
+    utc = data.utc_seconds()
+    order = utc.argsort(kind="stable")
+    get_anomaly_detector().ingest_readings(
+        (float(utc[i]), pid, data.device_ids[data.device[i]],
+         pool.lookup(data.code[i]), float(data.value[i]), str(data.timestamp[i]))
+        for i in order.tolist()
+    )
+    return data
+
 def get_observations(pid):
+    ensure_subscriptions(pid)
+    return fetch_observations(pid, get_subscription_hub().generation(pid, "Observation"))
+
+@instrumented_cache(max_entries=PATIENT_CACHE_ENTRIES)
+def fetch_observations(pid, generation = 0):
     url = f"{FHIR_BASE_URL}/Observation?subject=Patient/{pid}"
-    res = requests.get(url, headers=auth_headers())
-    observations = []
-    if res.status_code == 200:
-        bundle = res.json()
-        # Extract the "resource" from each entry in the bundle
-        for entry in bundle.get("entry", []):
-            resource = entry.get("resource")
-            if resource:
-                observations.append(resource)
-    else:
-        st.warning(f"Failed to fetch Observations for Patient/{pid}: {res.status_code}")
-    return observations
+    return list(iter_bundle("Observation?subject", url, f"Observations for Patient/{pid}", resource_types={"Observation"}))
 
-@st.cache_data
-def get_patient_everything(pid):
-    
+@st.cache_resource
+def get_anomaly_detector():
+    # Process-wide, so flags raised while one session syncs are visible to every session
+    return Alerts.AnomalyDetector()
+
+def get_alert_flags(pid):
+    get_patient_data(pid) # alerting is fed from the store, so make sure this patient has been loaded
+    return get_anomaly_detector().get_flags(pid)
+
+def iter_patient_everything(pid, resource_types = None, elements = None):
+    # Uncached and streamed: consumers aggregate or stop as they go instead of keeping the whole compartment
     url = f"{FHIR_BASE_URL}/Patient/{pid}/$everything"
-    res = requests.get(url, headers=auth_headers())
-    bundle_contents = []
-    if res.status_code == 200:
+    return iter_bundle("Patient/{id}/$everything", url, f"Patient/{pid}/$everything", resource_types, elements)
+
+def iter_bundle(endpoint, url, description, resource_types = None, elements = None):
+    """Stream a search/operation Bundle and yield its resources one at a time (see BundleStream.py)."""
+    res, chunks = timed_stream(endpoint, url, headers=auth_headers())
+    if res.status_code != 200:
+        warn(f"Failed to fetch {description}: {res.status_code}")
+        for _ in chunks: # drain the (small) error body so the call is recorded and the connection released
+            pass
+        return
+    yield from iter_bundle_resources(chunks, resource_types, elements)
+
+def fetch_patient_names(url, strict = False):
+    # Follow the Bundle 'next' links, pulling only Patient.name for each page.
+    # With `strict`, a failed page raises instead of ending the listing early.
+    while url:
+        res = timed_get("Patient?_elements=name", url, headers=auth_headers())
+        if res.status_code != 200:
+            if strict:
+                raise RuntimeError(f"Failed to fetch Patient names: {res.status_code}")
+            warn(f"Failed to fetch Patient names: {res.status_code}")
+            return
         bundle = res.json()
-        # Extract the "resource" from each entry in the bundle
         for entry in bundle.get("entry", []):
             resource = entry.get("resource")
-            if resource:
-                bundle_contents.append(resource)
+            if resource and resource.get("resourceType") == "Patient":
+                yield resource.get("id"), get_patient_display_name(resource)
+        url = next((link["url"] for link in bundle.get("link", []) if link.get("relation") == "next"), None)
+
+@st.cache_resource
+def get_patient_index_builder():
+    return BackgroundIndex(retry_seconds=PATIENT_INDEX_RETRY_SECONDS)
+
+def get_patient_index():
+    """The process-wide local name index, or None while it is still being built in the background."""
+    headers = auth_headers()
+    url = f"{FHIR_BASE_URL}/Patient?_elements=name&_count={PATIENT_PAGE_SIZE}"
+    return get_patient_index_builder().get(
+        lambda: run_in_background(headers, lambda: list(fetch_patient_names(url, strict=True))))
+
+@instrumented_cache(ttl=RESOURCE_TOTAL_TTL)
+def get_resource_total(resource_type):
+    # Server-wide count, so Home's totals describe the same population as the picker (not the registry's)
+    endpoint = f"{resource_type}?_summary=count"
+    res = timed_get(endpoint, f"{FHIR_BASE_URL}/{endpoint}", headers=auth_headers())
+    if res.status_code != 200:
+        warn(f"Failed to count {resource_type} resources: {res.status_code}")
+        return None
+    return res.json().get("total")
+
+@instrumented_cache
+def search_patients_server(query, limit = PATIENT_PICKER_LIMIT):
+    # Also lists the first page of patients (empty query) while the local index is being built
+    if query:
+        url = f"{FHIR_BASE_URL}/Patient?name:contains={quote(query)}&_elements=name&_count={limit}"
     else:
-        st.warning(f"Failed to fetch Patient/{pid}/$everything: {res.status_code}")
-    return bundle_contents
+        url = f"{FHIR_BASE_URL}/Patient?_elements=name&_count={limit}"
+    results = []
+    for entry in fetch_patient_names(url):
+        results.append(entry)
+        if len(results) == limit:
+            break
+    return results
+
+@st.cache_resource
+def get_prefetcher():
+    return Prefetch.Prefetcher(max_workers=PREFETCH_WORKERS)
+
+def prefetch_patients(pids, session=None):
+    """Warm the caches for `pids` in the background, replacing this session's earlier prefetch request."""
+    if session is None:
+        ctx = get_script_run_ctx()
+        session = ctx.session_id if ctx else None
+    # Workers get this session's auth headers, but no script context: nothing they do reaches a page
+    headers = auth_headers()
+    def in_background(fetch):
+        return lambda pid: run_in_background(headers, fetch, pid)
+    # Warm the shared ObservationStore: it's what the Dashboard and the Chat context read
+    get_prefetcher().retarget(session, pids, [in_background(get_patient_data)])
 
 def render_sidebar_patient_select():
     ## Sidebar for patient selection
-    patients = get_patients()
-    patient_options = [
-        {"id": p.get("id"), "name": get_patient_display_name(p)}
-        for p in patients
-    ]
-    patient_dict = {p["name"]: p["id"] for p in patient_options}
-    selected_name = st.sidebar.selectbox("Select Patient", list(patient_dict.keys()))
-    patient_id = patient_dict[selected_name]
+    # Only a bounded page of matches is rendered, so this stays constant-time however big the cohort is.
+    # Until the local index has been built in the background, the server answers the search.
+    index = get_patient_index()
+    query = st.sidebar.text_input("Search Patients", key="patient_search")
+    if index is None:
+        st.sidebar.caption("Patient index loading, searching on the server.")
+        options = search_patients_server(query.strip())
+    else:
+        options = index.search(query, limit=PATIENT_PICKER_LIMIT)
+        if not options and query.strip():
+            options = search_patients_server(query.strip())
+    # Keep the current patient selectable even when it's outside the current search results
+    selected = st.session_state.get("selected_patient")
+    if selected and selected not in options:
+        options = [selected] + options
+    if not options:
+        st.sidebar.info("No patients match your search.")
+        st.stop()
+    # The options change between reruns, which resets a selectbox to its default, so the default is
+    # always the stored selection; otherwise a rerun or page switch would quietly pick another patient
+    patient_id, selected_name = st.sidebar.selectbox(
+        "Select Patient", options, index=options.index(selected) if selected in options else 0,
+        format_func=lambda option: option[1], key="patient_select"
+    )
+    st.session_state["selected_patient"] = (patient_id, selected_name)
+
+    recent = [pid for pid in st.session_state.get("recent_patients", []) if pid != patient_id]
+    st.session_state["recent_patients"] = [patient_id] + recent[:PREFETCH_RECENT - 1]
+    first_render = not st.session_state.get("prefetch_started")
+    st.session_state["prefetch_started"] = True
+    prefetch_patients(likely_next_patients(options, patient_id, recent, first_render))
     return patient_id, selected_name
 
+def likely_next_patients(options, patient_id, recent, first_render = False):
+    """Neighbours of the selection in the picker, then recently viewed patients.
+    On a session's first render the top of the picker is warmed as well."""
+    position = next(i for i, (pid, _) in enumerate(options) if pid == patient_id)
+    neighbours = [
+        options[i][0] for offset in range(1, PREFETCH_NEIGHBOURS + 1)
+        for i in (position + offset, position - offset) if 0 <= i < len(options)
+    ]
+    if first_render:
+        neighbours += [pid for pid, _ in options[:PREFETCH_STARTUP]]
+    return neighbours + recent[:PREFETCH_RECENT]
+
+def watch_for_updates(pid):
+    """Rerun the page when a notification invalidates this patient's data.
+
+    Only the in-process generation counters are checked, so this costs nothing on the FHIR side.
+    """
+    hub = get_subscription_hub()
+    st.session_state["seen_generations"] = (pid, hub.generation(pid, "Device"), hub.generation(pid, "Observation"))
+
+    @st.fragment(run_every=UPDATE_CHECK_SECONDS)
+    def check():
+        current = (pid, hub.generation(pid, "Device"), hub.generation(pid, "Observation"))
+        if current != st.session_state.get("seen_generations"):
+            st.rerun()
+
+    if hub.receiving:
+        check()
+
 def render_sidebar_observations_select(pid):
-    observations = get_observations(pid)
-    obs_types = sorted(
-        set(
-            obs.get("code", {}).get("text") or
-            obs.get("code", {}).get("coding", [{}])[0].get("display", "")
-            for obs in observations
-        )
-    )
+    obs_types = get_patient_data(pid).type_names()
     selected_types = st.sidebar.multiselect("Observation Types", obs_types, default=obs_types)
     return selected_types
 
@@ -184,11 +475,29 @@ def render_sidebar_bottom():
     </a>
     """,
     unsafe_allow_html=True)
+    render_sidebar_performance()
     st.sidebar.markdown("---")
     if "user" in st.session_state and st.sidebar.button("Force Log Out / Reset Login"):
         st.session_state.clear()
         st.rerun()
 
+def render_sidebar_performance():
+    ## Debug panel: per-endpoint latency, payload size and status, plus cache hit ratios for this process
+    with st.sidebar.expander("Performance"):
+        call_rows, cache_rows = METRICS.summary()
+        if call_rows:
+            st.dataframe(call_rows, hide_index=True)
+        else:
+            st.write("No outbound calls recorded yet.")
+        if cache_rows:
+            st.dataframe(cache_rows, hide_index=True)
+        st.download_button("Prometheus", METRICS.to_prometheus(), "metrics.prom", key="MetricsProm")
+        st.download_button("JSON lines", METRICS.to_json_lines(), "metrics.jsonl", key="MetricsJsonl")
+        st.write("Observation store")
+        st.dataframe([get_observation_store().stats()], hide_index=True)
+        if st.button("Reset Metrics", key="MetricsReset"):
+            METRICS.reset()
+
 @st.cache_data
 def get_tools():
     tools = [
@@ -246,7 +555,31 @@ def get_tools():
     ]
     return tools
 
-def use_tools(tool_calls):
+def resources_json(resources, max_chars = None):
+    """JSON array of whole resources that fits in `max_chars`.
+
+    When the budget runs out the array ends with a "...truncated" string instead of a half resource.
+    A list says how many resources were left out; a stream (e.g. $everything) is closed there
+    rather than downloaded just to count the rest.
+    """
+    marker_chars = 64
+    parts = []
+    size = 2
+    for resource in resources:
+        part = json.dumps(resource)
+        if max_chars is not None and size + len(part) + marker_chars > max_chars:
+            if isinstance(resources, list):
+                marker = f"...truncated, {len(resources) - len(parts)} more resources"
+            else:
+                resources.close()
+                marker = "...truncated, more resources not shown"
+            parts.append(json.dumps(marker))
+            break
+        parts.append(part)
+        size += len(part) + 2
+    return "[" + ", ".join(parts) + "]"
+
+def use_tools(tool_calls, max_chars = None):
     results = []
     for call in tool_calls:
         id = call.id
@@ -256,17 +589,18 @@ def use_tools(tool_calls):
         # You can add extra logic if needed. 
         # I wrote this as 'if' statements for readability, but a guardrailed exec() might be OK if you are careful about code injections
         if function_name == "get_observations":
-            result = get_observations(args["pid"])
+            content = resources_json(get_observations(args["pid"]), max_chars)
         elif function_name == "get_devices":
-            result = get_devices(args["pid"])
+            content = resources_json(get_devices(args["pid"]), max_chars)
         elif function_name == "get_patient_everything":
-            result = get_patient_everything(args["pid"])
+            # Streamed and cut at the budget, so the tool never downloads or caches the whole compartment
+            content = resources_json(iter_patient_everything(args["pid"]), max_chars)
         else:
-            result = {"error": f"Unknown function: {function_name}"}
+            content = json.dumps({"error": f"Unknown function: {function_name}"})
 
         results.append({
             "role": "tool",
             "tool_call_id": id,
-            "content": json.dumps(result)
+            "content": content
         })
     return results
\ No newline at end of file
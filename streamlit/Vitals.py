@@ -0,0 +1,125 @@
+import re
+from datetime import datetime
+
+## Device and vital-sign definitions shared by fakerDevices, the analytics engine and alerting.
+## Ranges are the normal ranges the generator draws from; downstream they double as reference ranges.
+## Also the shared FHIR dateTime parsing, so the observation store and alerting agree on times.
+
+DEVICE_TYPES = [
+    {"type": "Smartwatch", "code": {"system": "http://snomed.info/sct", "code": "706168006", "display": "Smart watch device"}},
+    {"type": "BP Cuff", "code": {"system": "http://snomed.info/sct", "code": "705051002", "display": "Blood pressure cuff"}},
+    {"type": "Pulse Oximeter", "code": {"system": "http://snomed.info/sct", "code": "706170002", "display": "Pulse oximeter"}},
+    {"type": "CGM", "code": {"system": "http://snomed.info/sct", "code": "706171003", "display": "Continuous glucose monitor"}}
+]
+
+OBSERVATION_TYPES = [
+    {
+        "label": "Heart rate",
+        "code": {"system": "http://loinc.org", "code": "8867-4", "display": "Heart rate"},
+        "unit": "beats/minute", "unit_code": "bpm", "range": (55, 110)
+    },
+    {
+        "label": "Respiratory rate",
+        "code": {"system": "http://loinc.org", "code": "9279-1", "display": "Respiratory rate"},
+        "unit": "breaths/minute", "unit_code": "breaths/min", "range": (12, 22)
+    },
+    {
+        "label": "Systolic blood pressure",
+        "code": {"system": "http://loinc.org", "code": "8480-6", "display": "Systolic blood pressure"},
+        "unit": "mmHg", "unit_code": "mm[Hg]", "range": (100, 140)
+    },
+    {
+        "label": "Diastolic blood pressure",
+        "code": {"system": "http://loinc.org", "code": "8462-4", "display": "Diastolic blood pressure"},
+        "unit": "mmHg", "unit_code": "mm[Hg]", "range": (60, 90)
+    },
+    {
+        "label": "Body temperature",
+        "code": {"system": "http://loinc.org", "code": "8310-5", "display": "Body temperature"},
+        "unit": "Celsius", "unit_code": "Cel", "range": (36.0, 38.0)
+    },
+    {
+        "label": "Blood oxygen saturation (SpO2)",
+        "code": {"system": "http://loinc.org", "code": "59408-5", "display": "Oxygen saturation in Arterial blood"},
+        "unit": "%", "unit_code": "%", "range": (92, 100)
+    },
+    {
+        "label": "Heart rate variability",
+        "code": {"system": "http://loinc.org", "code": "80372-6", "display": "HRV (Standard deviation of NN intervals)"},
+        "unit": "ms", "unit_code": "ms", "range": (20, 120)
+    },
+    {
+        "label": "Skin temperature",
+        "code": {"system": "http://loinc.org", "code": "8328-7", "display": "Skin temperature"},
+        "unit": "Celsius", "unit_code": "Cel", "range": (32.0, 36.0)
+    },
+    {
+        "label": "Glucose (CGM)",
+        "code": {"system": "http://loinc.org", "code": "15074-8", "display": "Glucose [Moles/volume] in Capillary blood"},
+        "unit": "mmol/L", "unit_code": "mmol/L", "range": (3.5, 10.0)
+    },
+    {
+        "label": "Step count",
+        "code": {"system": "http://loinc.org", "code": "41950-7", "display": "Number of steps in 24 hours"},
+        "unit": "steps", "unit_code": "steps", "range": (1000, 20000)
+    },
+    {
+        "label": "Calories burned",
+        "code": {"system": "http://loinc.org", "code": "41981-2", "display": "Calories burned"},
+        "unit": "kcal", "unit_code": "kcal", "range": (1500, 4000)
+    },
+    {
+        "label": "Distance walked/run",
+        "code": {"system": "http://loinc.org", "code": "41953-1", "display": "Distance walked or run in 24 hours"},
+        "unit": "km", "unit_code": "km", "range": (1.0, 20.0)
+    },
+    {
+        "label": "Duration of exercise",
+        "code": {"system": "http://loinc.org", "code": "55411-3", "display": "Exercise duration"},
+        "unit": "minutes", "unit_code": "min", "range": (10, 120)
+    },
+    {
+        "label": "Exercise heart rate",
+        "code": {"system": "http://loinc.org", "code": "55423-8", "display": "Heart rate during exercise"},
+        "unit": "beats/minute", "unit_code": "bpm", "range": (90, 170)
+    }
+]
+
+# LOINC code -> observation type, for range lookups
+OBSERVATION_TYPES_BY_CODE = {t["code"]["code"]: t for t in OBSERVATION_TYPES}
+
+def first_coding(codeable):
+    # fakerDevices writes Observation.code.coding as a single object, FHIR servers return a list
+    coding = (codeable or {}).get("coding") or {}
+    if isinstance(coding, list):
+        coding = coding[0] if coding else {}
+    return coding
+
+# FHIR dateTime at any precision: YYYY, YYYY-MM, YYYY-MM-DD, or a full time with an optional offset
+_DATETIME = re.compile(
+    r"(\d{4})(?:-(\d{2})(?:-(\d{2})(?:T(\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?)?)?(Z|[+-]\d{2}:\d{2})?"
+)
+_EPOCH = datetime(1970, 1, 1)
+
+def parse_effective(value):
+    """Split a FHIR dateTime into (wall-clock seconds, UTC offset in minutes).
+
+    Wall-clock seconds count from 1970-01-01 in the value's own local time, so the clock time shown
+    is the one in the source. Missing parts of a partial date default to the start of the period;
+    a value without an offset gets offset 0. Raises ValueError for anything else.
+    """
+    match = _DATETIME.fullmatch(value.strip()) if isinstance(value, str) else None
+    if not match:
+        raise ValueError(f"Not a FHIR dateTime: {value!r}")
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    wall = datetime(int(year), int(month or 1), int(day or 1), int(hour or 0), int(minute or 0), int(second or 0))
+    seconds = (wall - _EPOCH).total_seconds() + (float("0." + fraction) if fraction else 0.0)
+    offset = 0
+    if zone and zone != "Z":
+        offset = (int(zone[1:3]) * 60 + int(zone[4:6])) * (-1 if zone[0] == "-" else 1)
+    return seconds, offset
+
+def utc_seconds(value):
+    """Epoch seconds (UTC) for a FHIR dateTime of any precision."""
+    seconds, offset = parse_effective(value)
+    return seconds - offset * 60
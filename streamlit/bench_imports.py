@@ -0,0 +1,72 @@
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+
+## Cold-start import cost per page.
+## For each page, the unconditional module-level imports are imported in a fresh interpreter with
+## -X importtime, so the numbers reflect what a new Streamlit process pays before the first render.
+## Imports inside functions or if-blocks (the lazy paths) are deliberately not counted.
+## Usage (from the streamlit folder): python bench_imports.py [--repeat 3] [--out bench_imports.jsonl]
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGES = ["Home.py", "pages/Dashboard.py", "pages/Chat.py"]
+
+def module_level_imports(path):
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def measure(modules):
+    """Import `modules` in a fresh interpreter. Returns (wall seconds, {top-level module: cumulative us})."""
+    code = "\n".join(f"import {m}" for m in modules)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=APP_DIR, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        if name in modules:
+            cumulative[name] = int(cumulative_us)
+    return elapsed, cumulative
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold-start import cost per Streamlit page.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="Append results as JSON lines, to track cost across commits")
+    args = parser.parse_args()
+
+    records = []
+    for page in PAGES:
+        modules = module_level_imports(os.path.join(APP_DIR, page))
+        runs = [measure(modules) for _ in range(args.repeat)]
+        best_wall, breakdown = min(runs, key=lambda run: run[0])
+        records.append({"page": page, "wall_s": round(best_wall, 3), "modules_ms": {
+            name: round(us / 1000, 1) for name, us in sorted(breakdown.items(), key=lambda item: -item[1])
+        }})
+        print(f"{page}: {best_wall * 1000:.0f} ms (interpreter start included)")
+        for name, ms in records[-1]["modules_ms"].items():
+            print(f"    {name:<20} {ms:>8.1f} ms")
+
+    if args.out:
+        with open(args.out, "a") as f:
+            for record in records:
+                record["ts"] = time.time()
+                f.write(json.dumps(record) + "\n")
@@ -0,0 +1,379 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+## Multi-session load test for the Streamlit data layer (Utils.py).
+## Starts a stub FHIR server with configurable latency in a child process (so its JSON encoding
+## neither counts towards our memory nor competes for our GIL), points Utils at it, then runs N
+## concurrent simulated sessions through Home -> picker + Dashboard patient switches -> Chat tool calls.
+## Reports p50/p99 build time and FHIR request fan-out per page step, background (prefetch and
+## index) fan-out, and process memory.
+## Usage (from the streamlit folder):
+##   python loadtest.py --sessions 50 --switches 5 --latency-ms 40
+## The page scripts themselves aren't executed; each step calls the same Utils functions the page
+## calls, in the same order, so widget rendering time is not included.
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MAPPINGS = os.path.join(APP_DIR, "..", "bulk", "mappings_2.csv")
+DEFAULT_OUTPUT_DIR = os.path.join(APP_DIR, "..", "bulk", "devices", "fhir_output")
+TOOL_RESULT_CHARS = 20000 # same per-call budget as pages/Chat.py
+
+class StubData:
+    """Patients, Devices and Observations served by the stub, indexed by patient id."""
+
+    def __init__(self, patient_ids, devices, observations):
+        self.patient_ids = patient_ids
+        self.patients = {
+            pid: {"resourceType": "Patient", "id": pid, "name": [{"given": [f"Test{i}"], "family": f"Patient{i}"}]}
+            for i, pid in enumerate(patient_ids)
+        }
+        self.devices = defaultdict(list)
+        for device in devices:
+            self.devices[device["patient"]["reference"].split("/")[-1]].append(device)
+        self.observations = defaultdict(list)
+        for obs in observations:
+            self.observations[obs["subject"]["reference"].split("/")[-1]].append(obs)
+
+    @classmethod
+    def load(cls, mappings_path, output_dir):
+        import Registry
+        from Vitals import OBSERVATION_TYPES
+        patient_ids = list(Registry.open_registry(mappings_path).iter_ids("Patient"))
+        with open(os.path.join(output_dir, "devices.json")) as f:
+            devices = json.load(f)
+        observations_path = os.path.join(output_dir, "observations.json")
+        if os.path.exists(observations_path):
+            with open(observations_path) as f:
+                observations = json.load(f)
+        else:
+            # fakerDevices' observations.json isn't checked in; synthesize the same shape
+            observations = []
+            for device in devices:
+                for obs_type in random.sample(OBSERVATION_TYPES, 4):
+                    for _ in range(3):
+                        observations.append({
+                            "resourceType": "Observation",
+                            "id": str(uuid.uuid4()),
+                            "status": "final",
+                            "code": {"coding": [obs_type["code"]]},
+                            "subject": device["patient"],
+                            "device": {"reference": f"Device/{device['id']}"},
+                            "effectiveDateTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - random.randint(0, 30 * 86400))),
+                            "valueQuantity": {"value": round(random.uniform(*obs_type["range"]), 1), "unit": obs_type["unit"]},
+                        })
+        return cls(patient_ids, devices, observations)
+
+def searchset(resources, next_url=None):
+    bundle = {"resourceType": "Bundle", "type": "searchset", "total": len(resources),
+              "entry": [{"resource": r} for r in resources]}
+    if next_url:
+        bundle["link"] = [{"relation": "next", "url": next_url}]
+    return bundle
+
+class StubFHIRServer:
+    def __init__(self, data, latency_ms=30, jitter_ms=10, port=0):
+        self.data = data
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.requests = defaultdict(int)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def route(self, method, path, query):
+        parts = [p for p in path.split("/") if p]
+        data = self.data
+        if method in ("POST", "PUT"):
+            return f"{method} {parts[0]}", 201, {"resourceType": parts[0], "id": str(uuid.uuid4())}
+        if method == "DELETE":
+            return f"DELETE {parts[0]}", 204, {}
+        if parts == ["Patient"]:
+            if query.get("_summary") == ["count"]:
+                return "Patient?_summary=count", 200, {"resourceType": "Bundle", "type": "searchset", "total": len(data.patient_ids)}
+            if "name:contains" in query:
+                needle = query["name:contains"][0].lower()
+                matches = [p for p in data.patients.values() if needle in json.dumps(p["name"]).lower()]
+                return "Patient?name:contains", 200, searchset(matches[:int(query.get("_count", ["50"])[0])])
+            count = int(query.get("_count", ["100"])[0])
+            offset = int(query.get("_offset", ["0"])[0])
+            page = [data.patients[pid] for pid in data.patient_ids[offset:offset + count]]
+            next_url = None
+            if offset + count < len(data.patient_ids):
+                next_url = f"{self.base_url}/Patient?_elements=name&_count={count}&_offset={offset + count}"
+            return "Patient?_elements=name", 200, searchset(page, next_url)
+        if len(parts) == 2 and parts[0] == "Patient":
+            patient = data.patients.get(parts[1])
+            return "Patient/{id}", (200 if patient else 404), patient or {}
+        if len(parts) == 3 and parts[2] == "$everything":
+            pid = parts[1]
+            return "Patient/{id}/$everything", 200, searchset(
+                [data.patients.get(pid, {})] + data.devices[pid] + data.observations[pid])
+        if parts == ["Device"]:
+            if query.get("_summary") == ["count"]:
+                total = sum(len(devices) for devices in data.devices.values())
+                return "Device?_summary=count", 200, {"resourceType": "Bundle", "type": "searchset", "total": total}
+            pid = query.get("patient", [""])[0].split("/")[-1]
+            return "Device?patient", 200, searchset(data.devices[pid])
+        if parts == ["Observation"]:
+            pid = query.get("subject", [""])[0].split("/")[-1]
+            return "Observation?subject", 200, searchset(data.observations[pid])
+        return "unknown", 404, {}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                url = urlparse(self.path)
+                if method in ("POST", "PUT"):
+                    self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                label, status, body = stub.route(method, url.path, parse_qs(url.query))
+                with stub._lock:
+                    stub.requests[label] += 1
+                time.sleep(max(0.0, random.gauss(stub.latency_ms, stub.jitter_ms)) / 1000)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/fhir+json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == "/__stats": # request counts for the parent process; not a FHIR call
+                    with stub._lock:
+                        payload = json.dumps(stub.requests).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                self._respond("GET")
+
+            def do_PUT(self):
+                self._respond("PUT")
+
+            def do_DELETE(self):
+                self._respond("DELETE")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def serve_stub(latency_ms, jitter_ms, mappings_path, output_dir):
+    """Child process entry point: serve until killed, after printing the port for the parent."""
+    stub = StubFHIRServer(StubData.load(mappings_path, output_dir), latency_ms, jitter_ms)
+    print(stub.server.server_address[1], flush=True)
+    stub.server.serve_forever()
+
+class StubProcess:
+    def __init__(self, latency_ms, jitter_ms, mappings_path, output_dir):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve-stub", "--latency-ms", str(latency_ms),
+             "--jitter-ms", str(jitter_ms), "--mappings", mappings_path, "--fhir-output", output_dir],
+            stdout=subprocess.PIPE, text=True, cwd=APP_DIR
+        )
+        port = self.process.stdout.readline().strip()
+        if not port:
+            raise RuntimeError("Stub FHIR server failed to start")
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    def requests(self):
+        import urllib.request
+        with urllib.request.urlopen(f"{self.base_url}/__stats") as response:
+            return json.load(response)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+def configure_app(base_url, mappings_path):
+    """Point demoSettings at the stub before Utils (and Auth) read it at import time."""
+    sys.path.insert(0, APP_DIR)
+    import demoSettings
+    demoSettings.base_url = base_url
+    demoSettings.mappings_path = mappings_path
+    for name in ("domain", "client_id", "client_secret"):
+        if not hasattr(demoSettings, name):
+            setattr(demoSettings, name, "loadtest")
+    import Utils
+    return Utils
+
+def tool_call(name, pid):
+    return SimpleNamespace(id=str(uuid.uuid4()), function=SimpleNamespace(name=name, arguments=json.dumps({"pid": pid})))
+
+def picker_options(Utils):
+    # What the sidebar selectbox lists before anything is typed
+    index = Utils.get_patient_index()
+    if index is None:
+        return Utils.search_patients_server("")
+    return index.search("", limit=Utils.PATIENT_PICKER_LIMIT)
+
+def page_steps(Utils, session, switches, rng):
+    """Yield (page, callable) in the order a clinician would hit them."""
+    def home():
+        if Utils.get_patient_index() is None:
+            Utils.get_resource_total("Patient")
+        Utils.get_resource_total("Device")
+        Utils.get_total_device_types()
+    yield "Home", home
+    recent = []
+    viewed = []
+    for switch in range(switches):
+        def picker(switch=switch):
+            # render_sidebar_patient_select without the widgets: list, pick, prefetch likely next patients
+            options = picker_options(Utils)
+            pid = rng.choice(options)[0]
+            viewed.append(pid)
+            others = [p for p in recent if p != pid]
+            Utils.prefetch_patients(Utils.likely_next_patients(options, pid, others, switch == 0), session=session)
+            recent[:] = [pid] + others[:Utils.PREFETCH_RECENT - 1]
+        yield "Picker", picker
+        def dashboard():
+            pid = viewed[-1]
+            Utils.get_patient_data(pid)
+            Utils.get_alert_flags(pid)
+        yield "Dashboard", dashboard
+    def chat():
+        pid = viewed[-1]
+        Utils.get_devices(pid)
+        Utils.get_observations(pid)
+        Utils.use_tools([tool_call("get_observations", pid), tool_call("get_patient_everything", pid)],
+                        max_chars=TOOL_RESULT_CHARS)
+    yield "Chat", chat
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it can't be read."""
+    if sys.platform == "win32":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                    (name, ctypes.c_size_t) for name in (
+                        "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                        "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")
+                ]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return None
+            return counters.PeakWorkingSetSize / (1024 * 1024)
+        except (AttributeError, OSError):
+            return None
+    import resource # Unix only
+    # ru_maxrss is KB on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def run(sessions, switches, latency_ms, jitter_ms, seed, mappings_path, output_dir):
+    stub = StubProcess(latency_ms, jitter_ms, mappings_path, output_dir)
+    try:
+        Utils = configure_app(stub.base_url, mappings_path)
+        from Metrics import METRICS
+
+        # Count FHIR calls per page step on the session's own thread; background threads
+        # (prefetch workers, the name index build) are counted separately by thread name
+        local = threading.local()
+        background = defaultdict(int)
+        background_lock = threading.Lock()
+        def count(kind, *args):
+            if kind != "fhir":
+                return
+            name = threading.current_thread().name
+            if name.startswith(("prefetch", "patient-index")):
+                with background_lock:
+                    background[name.rstrip("_0123456789")] += 1
+            else:
+                local.calls = getattr(local, "calls", 0) + 1
+        METRICS.add_observer(count)
+
+        timings = defaultdict(list)
+        fan_out = defaultdict(list)
+
+        def session(index):
+            rng = random.Random(seed + index)
+            for page, step in page_steps(Utils, f"loadtest-{index}", switches, rng):
+                local.calls = 0
+                start = time.perf_counter()
+                step()
+                timings[page].append(time.perf_counter() - start)
+                fan_out[page].append(local.calls)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            for future in [executor.submit(session, i) for i in range(sessions)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+        # Let queued prefetches finish so their fan-out is complete
+        prefetcher = Utils.get_prefetcher()
+        deadline = time.monotonic() + 30
+        while prefetcher.pending() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        stub_requests = stub.requests()
+    finally:
+        stub.stop()
+
+    print(f"{sessions} sessions, {switches} patient switches each, stub latency {latency_ms}±{jitter_ms} ms: {elapsed:.1f}s total")
+    print(f"{'page':<10} {'builds':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'FHIR/page avg':>14} {'max':>5}")
+    for page in ("Home", "Picker", "Dashboard", "Chat"):
+        t = timings[page]
+        if not t:
+            continue
+        print(f"{page:<10} {len(t):>7} {percentile(t, 0.5) * 1000:>9.0f} {percentile(t, 0.99) * 1000:>9.0f} "
+              f"{max(t) * 1000:>9.0f} {sum(fan_out[page]) / len(fan_out[page]):>14.1f} {max(fan_out[page]):>5}")
+    print("Background FHIR calls: " + (", ".join(f"{k}={v}" for k, v in sorted(background.items())) or "none"))
+    print("Stub requests by endpoint: " + ", ".join(f"{k}={v}" for k, v in sorted(stub_requests.items())))
+    # The stub runs in a child process, so it isn't included
+    max_rss = peak_rss_mb()
+    print(f"Peak process RSS (app only): " + (f"{max_rss:.0f} MB" if max_rss is not None else "n/a"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate concurrent sessions against a stub FHIR server.")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--switches", type=int, default=5, help="Dashboard patient switches per session")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mappings", default=DEFAULT_MAPPINGS)
+    parser.add_argument("--fhir-output", default=DEFAULT_OUTPUT_DIR, help="fakerDevices output folder")
+    parser.add_argument("--serve-stub", action="store_true", help=argparse.SUPPRESS) # child process mode
+    args = parser.parse_args()
+    if args.serve_stub:
+        serve_stub(args.latency_ms, args.jitter_ms, args.mappings, args.fhir_output)
+    else:
+        run(args.sessions, args.switches, args.latency_ms, args.jitter_ms, args.seed, args.mappings, args.fhir_output)
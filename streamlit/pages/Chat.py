@@ -1,58 +1,57 @@
 import streamlit as st
-import openai
 import json
 
 LOGGING = True
+EVERYTHING_CONTEXT_CHARS = 10000
+TOOL_RESULT_CHARS = 20000 # per tool call, so one long patient history can't blow up a turn
+
+import Utils
+import demoSettings
+from Metrics import timed_call
+from ChatMemory import ConversationMemory
 
 if LOGGING:
     import logging
-    logging.basicConfig(
-            level=logging.DEBUG,
-            handlers=[
-                logging.FileHandler("C:\SRC\GS2025\Developing on FHIR 2025\streamlit\pages\streamlit_logger.txt", mode='w'),
-                logging.StreamHandler()
-            ]                
-        )
+    # Set demoSettings.log_path to also log to a file
+    handlers = [logging.StreamHandler()]
+    if hasattr(demoSettings, "log_path"):
+        handlers.append(logging.FileHandler(demoSettings.log_path, mode='a'))
+    logging.basicConfig(level=logging.DEBUG, handlers=handlers)
     logger = logging.getLogger(__name__)
 
-import Utils
-import demoSettings
-
 st.title("Clinical Assistant")
 
 patient_id, selected_name = Utils.render_sidebar_patient_select()
 openai_tools = Utils.get_tools()
 
-client = openai.OpenAI(api_key=demoSettings.openai_api_key)
+@st.cache_resource
+def get_client():
+    # openai is only imported the first time a question is actually sent
+    import openai
+    return openai.OpenAI(api_key=demoSettings.openai_api_key)
 
-if "chat_histories" not in st.session_state: ## We are storing different chat histories for each patient
-    st.session_state.chat_histories = {}
-if patient_id not in st.session_state.chat_histories:
-    st.session_state.chat_histories[patient_id] = []
-
-def get_current_chat_history():
-    return st.session_state.chat_histories[patient_id]
+if "chat_memory" not in st.session_state: ## Bounded chat histories per patient, see ChatMemory.py
+    st.session_state.chat_memory = ConversationMemory()
+chat_memory = st.session_state.chat_memory
 
 def append_to_chat_history(role, content):
-    if "chat_histories" not in st.session_state:
-        st.session_state.chat_histories = {}
-    if patient_id not in st.session_state.chat_histories:
-        st.session_state.chat_histories[patient_id] = []
-    st.session_state.chat_histories[patient_id].append({"role": role, "content": content})
+    chat_memory.append(patient_id, role, content)
 
-def call_chatgpt(prompt, context=""):
+def call_chatgpt(prompt, context="", history=()):
     system_prompt = (
         "You are a clinical assistant with access to patient, device, and observation data. "
         "You can use the following Python functions to retrieve data: "
-        "get_patients(), get_devices(patient_id), get_observations(patient_id). "
+        "get_devices(patient_id), get_observations(patient_id), get_patient_everything(patient_id). "
         "The selected patient ID that must be used for FHIR queries is: " + str(patient_id) + ". The patient's name is " + str(selected_name) + "."
         "If the user asks for patient/device/observation info, use the selected patient."
     )
     messages = [
         {"role": "system", "content": system_prompt + "\n" + context},
+        *history,
         {"role": "user", "content": prompt}
     ]
-    response = client.chat.completions.create(
+    response = timed_call(
+        "llm", "chat.completions", get_client().chat.completions.create,
         model="o4-mini-2025-04-16",
         messages=messages,
         tools=openai_tools,
@@ -67,12 +66,13 @@ def call_chatgpt(prompt, context=""):
         for tool_call in message.tool_calls:
             tool_name = tool_call.function.name
             st.info(f"Using {tool_name}")
-        tool_messages = Utils.use_tools(message.tool_calls)
+        tool_messages = Utils.use_tools(message.tool_calls, max_chars=TOOL_RESULT_CHARS)
         messages.extend([message] + tool_messages)
 
         logger.info("Executing tools and sending result back to model...")
 
-        response2 = client.chat.completions.create(
+        response2 = timed_call(
+            "llm", "chat.completions", get_client().chat.completions.create,
             model="o4-mini-2025-04-16",
             messages=messages,
             tools=openai_tools,
@@ -84,33 +84,65 @@ def call_chatgpt(prompt, context=""):
     logger.warning("Model returned no content or tool calls!!")
     return "No response from model."
 
-def analyze_and_respond(user_input):
-    logger.debug(f"Analyzing input: {user_input}")
-    devices = Utils.get_devices(patient_id)
-    observations = Utils.get_observations(patient_id)
+def build_patient_context():
+    patient_data = Utils.get_patient_data(patient_id)
 
-    # Prep summaries for context injection
+    # Prep summaries for context injection: one line per device and per observation type,
+    # so the block stays the same size however many readings the patient has
     device_summary = "\n".join([
-        f"- {d.get('type', {}).get('text', d.get('id'))}" for d in devices
+        f"- {d.text} ({d.id})" for d in patient_data.devices
     ]) or "No devices found."
 
-    observation_summary = "\n".join([
-        f"- {o.get('code', {}).get('text') or o.get('code', {}).get('coding', [{}])[0].get('display', '')}"
-        for o in observations
-    ]) or "No observations found."
+    pool = patient_data.pool
+    utc = patient_data.utc_seconds()
+    observation_lines = []
+    for display in sorted(set(patient_data.display.tolist()), key=pool.lookup):
+        rows = (patient_data.display == display).nonzero()[0]
+        latest = rows[utc[rows].argmax()]
+        observation_lines.append(
+            f"- {pool.lookup(display)}: {len(rows)} readings, latest {patient_data.value[latest]:g} "
+            f"{pool.lookup(patient_data.unit[latest])} at {patient_data.timestamp[latest]}"
+        )
+    observation_summary = "\n".join(observation_lines) or "No observations found."
+
+    alert_summary = "\n".join([
+        f"- [{f['kind']}] {f['effectiveDateTime']}: {f['message']}" for f in Utils.get_alert_flags(patient_id)[-20:]
+    ]) or "No alerts raised."
 
-    context = (
+    return (
         f"Patient ID: {patient_id}\n"
         f"Patient Name: {selected_name}\n\n"
         f"Devices:\n{device_summary}\n\n"
-        f"Observations:\n{observation_summary}\n"
+        f"Observations:\n{observation_summary}\n\n"
+        f"Device alerts:\n{alert_summary}\n"
     )
+
+def analyze_and_respond(user_input):
+    logger.debug(f"Analyzing input: {user_input}")
+    # Rebuilt only when the patient's data or alerts change, otherwise reused from earlier turns
+    hub = Utils.get_subscription_hub()
+    flags = Utils.get_alert_flags(patient_id)
+    context_key = (
+        hub.generation(patient_id, "Observation"), hub.generation(patient_id, "Device"),
+        len(flags), flags[-1]["effectiveDateTime"] if flags else None
+    )
+    context = chat_memory.context(patient_id, context_key, build_patient_context)
+    history = chat_memory.prompt_history(patient_id)
     logger.debug("Calling OpenAI with injected context.")
-    return call_chatgpt(user_input, context=context)
+    return call_chatgpt(user_input, context=context, history=history)
 
 def everything_and_response(patient_id):
-    bundle = Utils.get_patient_everything(patient_id)
-    context = json.dumps(bundle, indent=2)[:10000]
+    # Stream $everything and stop reading once the context budget is used up,
+    # rather than downloading and caching the whole compartment just to truncate it
+    parts = []
+    size = 0
+    for resource in Utils.iter_patient_everything(patient_id):
+        part = json.dumps(resource, indent=2)
+        parts.append(part[:EVERYTHING_CONTEXT_CHARS - size])
+        size += len(parts[-1]) + 2
+        if size >= EVERYTHING_CONTEXT_CHARS:
+            break
+    context = "[\n" + ",\n".join(parts)
     system_prompt = (
         "You are a clinical assistant with access to a patient's entire compartment from a FHIR Patient/$everything response. "
         "You have all the data you need from the bundle contents pasted at the end of this prompt. "
@@ -130,9 +162,9 @@ with col2:
     everything_clicked = st.button("$everything", key="SendEverything")
 
 if send_clicked and user_input:
-    append_to_chat_history("user", user_input)
     with st.spinner("Thinking..."):
         response = analyze_and_respond(user_input)
+    append_to_chat_history("user", user_input)
     append_to_chat_history("assistant", response)
 
 if everything_clicked:
@@ -140,7 +172,11 @@ if everything_clicked:
         response = everything_and_response(patient_id)
     st.markdown(f"**Quick Ask Response:** {response}")
 
-for msg in st.session_state.chat_histories[patient_id]:
+earlier = chat_memory.summary(patient_id)
+if earlier:
+    with st.expander("Earlier in this conversation"):
+        st.markdown(earlier)
+for msg in chat_memory.turns(patient_id):
     if msg["role"] == "user":
         st.markdown(f"**You:** {msg['content']}")
     else:
@@ -1,4 +1,5 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -11,21 +12,28 @@ st.title("Device Dashboard")
 ## Sidebar for patient selection
 patient_id, selected_name = Utils.render_sidebar_patient_select()
 
-# based on selection, get associated devices and observations
-observations = Utils.get_observations(patient_id)
-devices = Utils.get_devices(patient_id)
+# based on selection, get associated devices and observations.
+# patient_data is shared, read-only and columnar (see ObservationStore.py): filter it, don't modify it
+patient_data = Utils.get_patient_data(patient_id)
+Utils.watch_for_updates(patient_id) # picks up Subscription notifications without pressing Refresh
+
+alert_flags = Utils.get_alert_flags(patient_id)
+if alert_flags:
+    with st.expander(f"⚠️ {len(alert_flags)} alerts for {selected_name}", expanded=True):
+        for flag in reversed(alert_flags[-10:]):
+            st.warning(f"{flag['effectiveDateTime'][:16].replace('T', ' ')} — {flag['message']} (Device `{flag['device']}`)")
 
 col1, col2 = st.columns([6, 1])
 with col1:
     st.subheader(f"Devices for {selected_name}")
 with col2:
     if st.button("Refresh", key="RefreshDevices"):
-        Utils.get_devices.clear()  # Clear the cache for get_devices
-        devices = Utils.get_devices(patient_id)
+        Utils.invalidate_patient(patient_id, "Device")  # Only this patient's data is refetched
+        patient_data = Utils.get_patient_data(patient_id)
+devices = patient_data.devices
 if devices:
-    for entry in devices:
-        d = entry
-        st.write(f"* {d.get('type', {}).get('text', 'Device')} — ID: `{d['id']}`")
+    for d in devices:
+        st.write(f"* {d.text} — ID: `{d.id}`")
 else:
     st.info("No devices found for this patient.")
 
@@ -35,46 +43,36 @@ with col3:
     st.subheader(f"Observations")
 with col4:
     if st.button("Refresh", key="RefreshObservations"):
-        Utils.get_observations.clear()  # Clear the cache for get_devices
-        devices = Utils.get_observations(patient_id)
+        Utils.invalidate_patient(patient_id, "Observation")
+        patient_data = Utils.get_patient_data(patient_id)
 
 selected_types = Utils.render_sidebar_observations_select(patient_id)
 
 # Date range filter
-dates = [
-    obs.get("effectiveDateTime", "")[:10]
-    for obs in observations if obs.get("effectiveDateTime")
-]
-if dates:
-    min_date, max_date = min(dates), max(dates)
+if len(patient_data):
+    min_date = patient_data.timestamp.min().astype(datetime).date()
+    max_date = patient_data.timestamp.max().astype(datetime).date()
     date_range = st.sidebar.date_input("Date Range", [min_date, max_date])
 else:
     date_range = None
 
-data = []
-if observations:
-    for obs in observations:
-        value = obs.get("valueQuantity", {}).get("value")
-        unit = obs.get("valueQuantity", {}).get("unit")
-        effective = obs.get("effectiveDateTime")
-        device_ref = obs.get("device", {}).get("reference", "")
-        device_id = device_ref.split("/")[-1] if device_ref else ""
-        coding_list = obs.get("code", {}).get("coding", [])
-        obs_type = coding_list[0].get("display") if coding_list else None
-        obs_code = coding_list[0].get("code") if coding_list else None
-        if obs_type in selected_types:
-            if date_range and effective:
-                if not (date_range[0] <= datetime.strptime(effective.split("T")[0],"%Y-%m-%d").date() <= date_range[1]):
-                    continue
-            data.append({
-                "Value": value,
-                "Unit": unit,
-                "Timestamp": effective[:10] + '   ' + effective[11:19],
-                "Type": obs_type,
-                "Code": obs_code,
-                "Device": device_id
-            })
-    df = pd.DataFrame(data, columns=["Value", "Unit", "Timestamp", "Type", "Code", "Device"])
+df = pd.DataFrame(columns=["Value", "Unit", "Timestamp", "Type", "Code", "Device"])
+if len(patient_data):
+    # Filter with masks over the shared arrays; only the selected rows are materialized
+    mask = patient_data.type_mask(selected_types)
+    if date_range and len(date_range) == 2:
+        days = patient_data.timestamp.astype("datetime64[D]")
+        mask &= (days >= np.datetime64(date_range[0])) & (days <= np.datetime64(date_range[1]))
+    pool = patient_data.pool
+    timestamps = np.datetime_as_string(patient_data.timestamp[mask], unit="s")
+    df = pd.DataFrame({
+        "Value": patient_data.value[mask],
+        "Unit": pool.take(patient_data.unit[mask]),
+        "Timestamp": np.char.replace(timestamps.astype(str), "T", "   "),
+        "Type": pool.take(patient_data.display[mask]),
+        "Code": pool.take(patient_data.code[mask]),
+        "Device": patient_data.device_column(mask),
+    })
     st.dataframe(
         df.sort_values("Timestamp", ascending=False),
         use_container_width=True
@@ -84,9 +82,6 @@ else:
 
 ## analytics
 
-import matplotlib.pyplot as plt
-import seaborn as sns
-
 st.subheader(f"Summary for {selected_name}")
 if not df.empty:
     col1, col2, col3 = st.columns(3)
@@ -117,6 +112,9 @@ if not df.empty:
     selected_dist_type = st.selectbox("Distribution Observation Type", selected_types, key="dist")
     dist_df = df[df["Type"] == selected_dist_type]
     if not dist_df.empty:
+        # matplotlib/seaborn are the slowest imports on this page, so only load them for the histogram
+        import matplotlib.pyplot as plt
+        import seaborn as sns
         fig, ax = plt.subplots()
         sns.histplot(dist_df["Value"], kde=True, ax=ax)
         ax.set_xlabel(selected_dist_type)
@@ -124,7 +122,7 @@ if not df.empty:
 
     # Device summary
     st.markdown("### Devices Used")
-    device_types = [d.get("type", {}).get("text", "Unknown") for d in devices]
+    device_types = [d.text for d in devices]
     st.bar_chart(pd.Series(device_types).value_counts())
 
     # Download button
@@ -0,0 +1,94 @@
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from BundleStream import iter_bundle_resources
+
+## Run from the repo root: python -m pytest streamlit/tests
+
+OBSERVATION = {
+    "resourceType": "Observation",
+    "id": "obs-1",
+    "status": "final",
+    "code": {"coding": [{"system": "http://loinc.org", "code": "8867-4", "display": "Heart rate"}]},
+    "subject": {"reference": "Patient/P1"},
+    "effectiveDateTime": "2025-05-01T10:00:00Z",
+    "valueQuantity": {"value": 72, "unit": "beats/minute"},
+    "note": [{"text": 'Tricky text: {"resourceType": "Device"} ] [ \\ éè ☃ "quoted"'}],
+}
+DEVICE = {"resourceType": "Device", "id": "dev-1", "patient": {"reference": "Patient/P1"}, "type": {"text": "Monitor"}}
+PATIENT = {"resourceType": "Patient", "id": "P1", "active": True, "name": [{"given": ["Ann"], "family": "Lee"}]}
+
+def bundle(resources, **extra):
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": len(resources),
+        "link": [{"relation": "self", "url": "http://example/Observation?x=[1]"}],
+        "entry": [{"fullUrl": f"urn:uuid:{i}", "resource": r, "search": {"mode": "match"}} for i, r in enumerate(resources)],
+        **extra,
+    }
+
+def chunked(text, size):
+    data = text.encode()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1 << 16])
+def test_matches_json_loads_at_any_chunk_size(size):
+    resources = [OBSERVATION, DEVICE, PATIENT, OBSERVATION]
+    text = json.dumps(bundle(resources, meta={"lastUpdated": "2025-05-01T10:00:00Z"}), indent=1)
+    assert list(iter_bundle_resources(chunked(text, size))) == resources
+
+def test_random_chunk_boundaries():
+    rng = random.Random(0)
+    resources = [OBSERVATION, DEVICE, PATIENT] * 20
+    data = json.dumps(bundle(resources), ensure_ascii=False).encode()
+    for _ in range(50):
+        cuts = sorted(rng.sample(range(1, len(data)), 40))
+        chunks = [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+        assert list(iter_bundle_resources(chunks)) == resources
+
+def test_str_chunks():
+    text = json.dumps(bundle([DEVICE]))
+    assert list(iter_bundle_resources([text[:10], text[10:]])) == [DEVICE]
+
+def test_resource_types_filter():
+    text = json.dumps(bundle([OBSERVATION, DEVICE, PATIENT]))
+    assert list(iter_bundle_resources(chunked(text, 5), resource_types={"Device"})) == [DEVICE]
+
+def test_contained_resource_before_resource_type_is_not_dropped():
+    # The first "resourceType" in the entry belongs to the contained Device, not the Observation
+    observation = {"contained": [DEVICE], **OBSERVATION}
+    text = json.dumps(bundle([observation]))
+    assert text.index('"Device"') < text.index('"Observation"')
+    assert list(iter_bundle_resources(chunked(text, 8), resource_types={"Observation"})) == [observation]
+    assert list(iter_bundle_resources(chunked(text, 8), resource_types={"Device"})) == []
+
+def test_elements_projection():
+    text = json.dumps(bundle([OBSERVATION]))
+    result = list(iter_bundle_resources(chunked(text, 16), elements=["valueQuantity", "effectiveDateTime"]))
+    assert result == [{
+        "resourceType": "Observation", "id": "obs-1",
+        "effectiveDateTime": OBSERVATION["effectiveDateTime"], "valueQuantity": OBSERVATION["valueQuantity"],
+    }]
+
+def test_entry_before_other_keys_and_entries_without_resource():
+    text = json.dumps({"entry": [{"fullUrl": "x"}, {"resource": DEVICE}], "resourceType": "Bundle", "total": 1, "next": None})
+    assert list(iter_bundle_resources(chunked(text, 3))) == [DEVICE]
+
+@pytest.mark.parametrize("body", ['{"resourceType": "Bundle", "total": 0}', '{}', '{"resourceType": "Bundle", "entry": []}'])
+def test_bundles_without_entries(body):
+    assert list(iter_bundle_resources([body.encode()])) == []
+
+def test_not_a_json_object():
+    with pytest.raises(ValueError):
+        list(iter_bundle_resources([b"[1, 2]"]))
+
+def test_truncated_bundle():
+    text = json.dumps(bundle([OBSERVATION, DEVICE]))
+    with pytest.raises(ValueError):
+        list(iter_bundle_resources(chunked(text[:len(text) // 2], 32)))
@@ -0,0 +1,56 @@
+import os
+import sys
+import urllib.error
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Subscriptions import StubNotifier, SubscriptionHub, SubscriptionReceiver
+
+## Run from the repo root: python -m pytest streamlit/tests
+
+SECRET = "test-secret"
+
+def observation(pid):
+    return {"resourceType": "Observation", "id": f"obs-{pid}", "subject": {"reference": f"Patient/{pid}"}}
+
+@pytest.fixture
+def hub():
+    return SubscriptionHub()
+
+@pytest.fixture
+def receiver_url(hub):
+    receiver = SubscriptionReceiver(hub, SECRET, port=0).start()
+    yield f"http://127.0.0.1:{receiver.port}"
+    receiver.stop()
+
+def test_notification_bumps_generation(hub, receiver_url):
+    assert StubNotifier(receiver_url, SECRET).notify("Observation", "P1", [observation("P1")]) == 200
+    assert hub.generation("P1", "Observation") == 1
+    assert hub.generation("*", "Observation") == 1
+    assert hub.generation("P1", "Device") == 0
+    assert hub.generation("P2", "Observation") == 0
+
+def test_empty_payload_bumps_generation(hub, receiver_url):
+    StubNotifier(receiver_url, SECRET).notify("Device", "P1")
+    assert hub.generation("P1", "Device") == 1
+
+def test_wrong_secret_is_rejected(hub, receiver_url):
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        StubNotifier(receiver_url, "wrong-secret").notify("Observation", "P1", [observation("P1")])
+    assert excinfo.value.code == 401
+    assert hub.generation("P1", "Observation") == 0
+
+def test_other_patients_resources_are_filtered_out(hub, receiver_url):
+    notifier = StubNotifier(receiver_url, SECRET)
+    assert notifier.notify("Observation", "P1", [observation("P2")]) == 200
+    assert hub.generation("P1", "Observation") == 0
+    assert hub.generation("P2", "Observation") == 0
+    notifier.notify("Observation", "P1", [observation("P2"), observation("P1")])
+    assert hub.generation("P1", "Observation") == 1
+    assert hub.generation("P2", "Observation") == 0
+
+def test_unknown_resource_type_is_not_found(hub, receiver_url):
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        StubNotifier(receiver_url, SECRET).notify("Patient", "P1")
+    assert excinfo.value.code == 404